@@ -0,0 +1,229 @@
+"""
+Room message broker behind ConnectionManager.
+
+A broadcast is published to the broker, which hands it to every worker that
+may hold sockets of that room. With a single worker the in-memory broker
+delivers it straight back to the local manager. With `uvicorn --workers N`
+one local hub process relays room messages between the workers over a Unix
+domain socket:
+
+    python -m app.broker
+
+and start the web workers with WS_BROKER_SOCKET pointing at the same path.
+If the hub cannot be reached, workers keep delivering to their own sockets
+and reconnect in the background.
+
+Wire format: every message is a frame `!IIH` (room id, message length,
+kind length) + kind + message, both UTF-8; the message is the frame's JSON
+text, so it is encoded once for local and relayed delivery alike.
+"""
+import os
+import struct
+import asyncio
+from typing import Callable, Optional
+
+from app.config import settings
+from app.codec import Frame
+
+HEADER = struct.Struct("!IIH")
+
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+# A worker that stops reading loses relayed frames instead of growing the hub's memory
+MAX_HUB_BUFFER_BYTES = 8 * 1024 * 1024
+
+# deliver(room_id, frame, kind, exclude) fans a message out to this worker's sockets
+Deliver = Callable[[int, Frame, Optional[str], object], None]
+
+
+def encode_frame(room_id: int, message: str, kind: Optional[str] = None) -> bytes:
+    body, name = message.encode(), (kind or "").encode()
+    return HEADER.pack(room_id, len(body), len(name)) + name + body
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Read one frame; returns (room_id, message, kind, raw frame bytes)."""
+    header = await reader.readexactly(HEADER.size)
+    room_id, length, kind_length = HEADER.unpack(header)
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds the limit")
+    rest = await reader.readexactly(kind_length + length)
+    kind = rest[:kind_length].decode() or None
+    return room_id, rest[kind_length:].decode(), kind, header + rest
+
+
+class Broker:
+    """Interface: publish room messages to every worker, including this one."""
+
+    def __init__(self):
+        self.deliver: Optional[Deliver] = None
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def publish(self, room_id: int, message: Frame, kind: Optional[str] = None, exclude=None):
+        """`exclude` is a local socket that must not receive the message (the sender)."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {"type": type(self).__name__}
+
+
+class InMemoryBroker(Broker):
+    """Single-process deployments: every room lives in this worker."""
+
+    async def publish(self, room_id: int, message: Frame, kind: Optional[str] = None, exclude=None):
+        self.deliver(room_id, message, kind, exclude)
+
+
+class UnixSocketBroker(Broker):
+    """
+    Multi-worker deployments on one host: messages are delivered locally and
+    relayed to the other workers through the hub at `path`.
+    """
+
+    def __init__(self, path: str, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.relayed = 0
+        self.received = 0
+        self.unrelayed = 0
+        self._writer = None
+        self._task = None
+        self._connected = None
+        self._warned = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def start(self, deliver: Deliver):
+        await super().start(deliver)
+        self._connected = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def wait_connected(self, timeout: float):
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (OSError, ConnectionError) as e:
+                if not self._warned:
+                    print(f"[Broker] Hub at {self.path} unreachable, delivering locally only: {e}")
+                    self._warned = True
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            self._warned = False
+            self._writer = writer
+            self._connected.set()
+            try:
+                while True:
+                    room_id, message, kind, _ = await read_frame(reader)
+                    self.received += 1
+                    self.deliver(room_id, Frame(text=message), kind, None)
+            except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+                print(f"[Broker] Lost the hub connection: {e!r}")
+            finally:
+                self._writer = None
+                self._connected.clear()
+                writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def publish(self, room_id: int, message: Frame, kind: Optional[str] = None, exclude=None):
+        self.deliver(room_id, message, kind, exclude)
+        if not self.connected or self._writer.transport.get_write_buffer_size() > MAX_HUB_BUFFER_BYTES:
+            self.unrelayed += 1
+            return
+        self._writer.write(encode_frame(room_id, message.text, kind))
+        self.relayed += 1
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def stats(self) -> dict:
+        return {
+            "type": type(self).__name__,
+            "connected": self.connected,
+            "relayed": self.relayed,
+            "received": self.received,
+            "unrelayed": self.unrelayed,
+        }
+
+
+class BrokerHub:
+    """Relays every frame a worker sends to all the other connected workers."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dropped = 0
+        self._workers = set()
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        print(f"[Broker Hub] Listening on {self.path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        for writer in list(self._workers):
+            writer.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._workers.add(writer)
+        try:
+            while True:
+                *_, frame = await read_frame(reader)
+                for peer in self._workers:
+                    if peer is writer or peer.is_closing():
+                        continue
+                    if peer.transport.get_write_buffer_size() > MAX_HUB_BUFFER_BYTES:
+                        self.dropped += 1
+                        continue
+                    peer.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._workers.discard(writer)
+            writer.close()
+
+
+def get_broker() -> Broker:
+    """The hub broker for WS_BROKER_SOCKET, or the in-memory broker for a single worker."""
+    if settings.WS_BROKER_SOCKET:
+        return UnixSocketBroker(settings.WS_BROKER_SOCKET)
+    return InMemoryBroker()
+
+
+def main():
+    path = settings.WS_BROKER_SOCKET or "/tmp/clinicvault-broker.sock"
+    try:
+        asyncio.run(BrokerHub(path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Wire encoding for consultation WebSocket frames.
+
+A broadcast is wrapped in a Frame once and the same encoded text (or
+MessagePack bytes) is sent to every recipient, instead of re-serializing the
+message per socket. orjson is used for JSON when installed. Clients that open
+the socket with the `clinicvault.msgpack` subprotocol (and a server with
+msgpack installed) receive binary MessagePack frames; what they send stays
+JSON text, since binary frames from the client carry audio.
+"""
+import json
+from typing import Optional, Union
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+MSGPACK_SUBPROTOCOL = "clinicvault.msgpack"
+
+
+def dumps(obj) -> str:
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def loads(data: Union[str, bytes]):
+    """Parse JSON; raises json.JSONDecodeError (orjson's error subclasses it)."""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def negotiate(requested) -> Optional[str]:
+    """The subprotocol to accept from the client's offered list, if any."""
+    if MSGPACK_AVAILABLE and MSGPACK_SUBPROTOCOL in (requested or ()):
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+class Frame:
+    """One outbound message, encoded at most once per wire format and shared by all recipients."""
+
+    __slots__ = ("_obj", "_text", "_packed")
+
+    def __init__(self, obj=None, text: Optional[str] = None):
+        self._obj = obj
+        self._text = text
+        self._packed = None
+
+    @classmethod
+    def of(cls, message) -> "Frame":
+        """Wrap a dict (encoded lazily) or already-encoded JSON text."""
+        if isinstance(message, Frame):
+            return message
+        if isinstance(message, str):
+            return cls(text=message)
+        return cls(obj=message)
+
+    @property
+    def obj(self):
+        if self._obj is None:
+            self._obj = loads(self._text)
+        return self._obj
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = dumps(self._obj)
+        return self._text
+
+    @property
+    def packed(self) -> bytes:
+        if self._packed is None:
+            self._packed = msgpack.packb(self.obj)
+        return self._packed
@@ -26,4 +26,62 @@ class Settings:
                 with open(encryption_key_file, 'wb') as f:
                     f.write(self.ENCRYPTION_KEY)
 
+        # Whisper model pool (0 instances = calibrate the split at startup; 0 threads = auto)
+        self.WHISPER_MODEL: str = os.getenv("WHISPER_MODEL", "base")
+        self.WHISPER_COMPUTE_TYPE: str = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+        self.WHISPER_INSTANCES: int = int(os.getenv("WHISPER_INSTANCES", "1"))
+        self.WHISPER_THREADS: int = int(os.getenv("WHISPER_THREADS", "0"))
+        self.WHISPER_PRELOAD: bool = os.getenv("WHISPER_PRELOAD", "false").lower() in ("1", "true", "yes")
+
+        # Transcription worker pool ("thread" or "process"); 0 workers = one per model instance
+        self.TRANSCRIBE_POOL: str = os.getenv("TRANSCRIBE_POOL", "thread")
+        self.TRANSCRIBE_WORKERS: int = int(os.getenv("TRANSCRIBE_WORKERS", "0"))
+        self.TRANSCRIBE_MAX_QUEUE: int = int(os.getenv("TRANSCRIBE_MAX_QUEUE", "8"))
+        self.TRANSCRIBE_TIMEOUT: float = float(os.getenv("TRANSCRIBE_TIMEOUT", "30"))
+        self.TRANSCRIBE_RETRY_AFTER: int = int(os.getenv("TRANSCRIBE_RETRY_AFTER", "2"))
+
+        # Cross-consultation micro-batching: trade a little latency for throughput
+        self.TRANSCRIBE_BATCH_SIZE: int = int(os.getenv("TRANSCRIBE_BATCH_SIZE", "8"))
+        self.TRANSCRIBE_BATCH_WAIT_MS: float = float(os.getenv("TRANSCRIBE_BATCH_WAIT_MS", "40"))
+        # Chunks one consultation may have queued before its oldest is dropped
+        self.TRANSCRIBE_ROOM_BACKLOG: int = int(os.getenv("TRANSCRIBE_ROOM_BACKLOG", "3"))
+
+        # Load-adaptive quality: stricter VAD, then a lighter model, while the queue is deep or decoding slow
+        self.TRANSCRIBE_ADAPTIVE: bool = os.getenv("TRANSCRIBE_ADAPTIVE", "true").lower() in ("1", "true", "yes")
+        self.TRANSCRIBE_LIGHT_MODEL: str = os.getenv("TRANSCRIBE_LIGHT_MODEL", "tiny")
+        self.TRANSCRIBE_ADAPTIVE_HIGH_RTF: float = float(os.getenv("TRANSCRIBE_ADAPTIVE_HIGH_RTF", "0.8"))
+        self.TRANSCRIBE_ADAPTIVE_DWELL_S: float = float(os.getenv("TRANSCRIBE_ADAPTIVE_DWELL_S", "10"))
+
+        # Unix socket of the shared transcription service (empty = decode in-process)
+        self.TRANSCRIBE_SERVICE_SOCKET: str = os.getenv("TRANSCRIBE_SERVICE_SOCKET", "")
+
+        # Cache of recent chunk transcripts so browser retries skip the decode
+        self.TRANSCRIBE_CACHE_SIZE: int = int(os.getenv("TRANSCRIBE_CACHE_SIZE", "256"))
+        self.TRANSCRIBE_CACHE_TTL: float = float(os.getenv("TRANSCRIBE_CACHE_TTL", "120"))
+
+        # Voice-activity gate in front of the model queue ("energy", "silero" or "off")
+        self.TRANSCRIBE_VAD: str = os.getenv("TRANSCRIBE_VAD", "energy")
+        self.TRANSCRIBE_VAD_THRESHOLD_DB: float = float(os.getenv("TRANSCRIBE_VAD_THRESHOLD_DB", "-45"))
+        self.TRANSCRIBE_VAD_MIN_SPEECH_MS: int = int(os.getenv("TRANSCRIBE_VAD_MIN_SPEECH_MS", "200"))
+
+        # Audio streamed over the consultation WebSocket is cut into windows of this length
+        self.TRANSCRIBE_STREAM_WINDOW_S: float = float(os.getenv("TRANSCRIBE_STREAM_WINDOW_S", "3"))
+
+        # Per-connection outbound WebSocket queue: peers that stop reading are shed, not waited on
+        self.WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+        self.WS_SEND_TIMEOUT: float = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+        self.WS_SEND_STALL_S: float = float(os.getenv("WS_SEND_STALL_S", "1"))
+        # Trickle-ICE candidates from one sender within this window share one frame (0 = no batching)
+        self.WS_ICE_COALESCE_MS: float = float(os.getenv("WS_ICE_COALESCE_MS", "20"))
+        # Recent room frames kept for reconnects (?since=<seq>): per room, and bytes across all rooms
+        self.WS_REPLAY_FRAMES: int = int(os.getenv("WS_REPLAY_FRAMES", "256"))
+        self.WS_REPLAY_ROOM_BYTES: int = int(os.getenv("WS_REPLAY_ROOM_BYTES", str(256 * 1024)))
+        self.WS_REPLAY_TOTAL_BYTES: int = int(os.getenv("WS_REPLAY_TOTAL_BYTES", str(32 * 1024 * 1024)))
+        # Unix socket of the room broker hub that links the workers' WebSockets (empty = single worker)
+        self.WS_BROKER_SOCKET: str = os.getenv("WS_BROKER_SOCKET", "")
+
+        # Audio chunks are decoded from memory; "memfd"/"tmpfs" spool for path-only decoders
+        self.TRANSCRIBE_SPOOL: str = os.getenv("TRANSCRIBE_SPOOL", "memory")
+        self.TRANSCRIBE_TMPFS_DIR: str = os.getenv("TRANSCRIBE_TMPFS_DIR", "/dev/shm")
+
 settings = Settings()
\ No newline at end of file
@@ -0,0 +1,361 @@
+"""
+Consultation room WebSocket connections.
+
+Every connection gets a bounded outbound queue drained by its own writer
+task, so a broadcast is an enqueue per peer and one slow client (a patient on
+3G, a half-dead socket) never holds up signaling or captions for the rest of
+the room. What happens when a peer's queue is full depends on the message
+type, see OVERFLOW_POLICY.
+
+Broadcasts go through a broker (app.broker) so that with several workers a
+room's members are reached whichever worker their socket landed on.
+
+Room frames (chat, transcripts) are numbered with a per-room `seq` and the
+most recent ones kept in a bounded ReplayLog, so a client that reconnects
+with `?since=<seq>` gets exactly the frames it missed. Signaling and interim
+captions are stale by then and are neither numbered nor kept. Sequence
+numbers belong to the worker; with several workers, replay needs sticky
+routing, otherwise the client is told to resync.
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Optional
+
+from fastapi import WebSocket
+
+from app.config import settings
+from app.broker import Broker, InMemoryBroker
+from app.codec import Frame, MSGPACK_SUBPROTOCOL, negotiate
+
+# Overflow policy per message type when a peer's queue is full:
+#   "drop"  - shed the oldest queued message of a droppable type to make room
+#             (a newer ICE candidate or interim caption supersedes it)
+#   "close" - never drop: a peer whose socket has stalled is disconnected
+#             instead, it reconnects and resyncs
+OVERFLOW_POLICY = {
+    "candidate": "drop",
+    "candidates": "drop",
+    "transcript_partial": "drop",
+}
+DEFAULT_OVERFLOW = "close"
+
+SLOW_CONSUMER_CLOSE_CODE = 1013  # "Try again later"
+
+# Frames that are useless after a reconnect: not numbered, not kept for replay
+UNREPLAYABLE = {"offer", "answer", "candidate", "candidates", "transcript_partial"}
+
+# Trickle-ICE candidates go one frame each to passthrough clients and, for
+# clients that opted in, bundled per sender into one "candidates" frame
+MAX_BATCHED_CANDIDATES = 32
+
+
+class ClientConnection:
+    """One peer's socket with its outbound queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, max_queue: int, send_timeout: float, stall_after: float,
+                 subprotocol: Optional[str] = None, batch_candidates: bool = False):
+        self.websocket = websocket
+        self.binary = subprotocol == MSGPACK_SUBPROTOCOL
+        self.batch_candidates = batch_candidates
+        self.max_queue = max(1, max_queue)
+        self.send_timeout = send_timeout
+        self.stall_after = stall_after
+        self.queue = deque()
+        self.dropped = 0
+        self.closed = False
+        self._sending_since = None
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._drain())
+
+    @property
+    def stalled(self) -> bool:
+        """Whether the writer has been stuck on one send for longer than stall_after."""
+        return self._sending_since is not None and time.monotonic() - self._sending_since >= self.stall_after
+
+    def wants(self, kind: Optional[str]) -> bool:
+        """Each ICE candidate reaches a peer either on its own or in a batch, never both."""
+        if kind == "candidate":
+            return not self.batch_candidates
+        if kind == "candidates":
+            return self.batch_candidates
+        return True
+
+    def enqueue(self, message: Frame, kind: Optional[str] = None) -> bool:
+        """Queue a message for this peer. Returns False if it was dropped or the peer shed."""
+        if self.closed:
+            return False
+        if len(self.queue) >= self.max_queue and not self._make_room(kind):
+            return False
+        self.queue.append((kind, message))
+        self._ready.set()
+        return True
+
+    def _make_room(self, kind: Optional[str]) -> bool:
+        for i, (queued_kind, _) in enumerate(self.queue):
+            if OVERFLOW_POLICY.get(queued_kind, DEFAULT_OVERFLOW) == "drop":
+                del self.queue[i]
+                self.dropped += 1
+                return True
+        if OVERFLOW_POLICY.get(kind, DEFAULT_OVERFLOW) == "drop":
+            self.dropped += 1
+            return False
+        # A burst can fill the queue before the writer gets a turn; only a peer
+        # whose socket stopped taking data (or that is far behind) is shed
+        if not self.stalled and len(self.queue) < self.max_queue * 2:
+            return True
+        print(f"[WebSocket] Closing slow consumer: {len(self.queue)} messages queued")
+        self.close(SLOW_CONSUMER_CLOSE_CODE)
+        return False
+
+    async def _drain(self):
+        try:
+            while not self.closed:
+                await self._ready.wait()
+                self._ready.clear()
+                while self.queue and not self.closed:
+                    _, frame = self.queue.popleft()
+                    self._sending_since = time.monotonic()
+                    # The frame caches its encoding: every recipient shares one serialization
+                    if self.binary:
+                        send = self.websocket.send_bytes(frame.packed)
+                    else:
+                        send = self.websocket.send_text(frame.text)
+                    await asyncio.wait_for(send, self.send_timeout)
+                    self._sending_since = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Timed out or the socket is gone: stop writing, the receive loop cleans up
+            print(f"[WebSocket] Send failed, dropping connection: {e!r}")
+            self.close()
+
+    def close(self, code: Optional[int] = None):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        # The flag ends the writer loop even if wait_for swallows the cancel
+        self._ready.set()
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        if code is not None:
+            asyncio.ensure_future(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ReplayLog:
+    """
+    The most recent numbered frames of each room, capped per room (frames and
+    bytes) and across rooms (bytes; the globally oldest frames go first).
+    """
+
+    def __init__(self, max_frames: int, room_bytes: int, total_bytes: int):
+        self.max_frames = max_frames
+        self.room_bytes = room_bytes
+        self.total_bytes = total_bytes
+        self.bytes = 0
+        self.evicted = 0
+        self.head: Dict[int, int] = {}  # room -> last seq handed out
+        # room -> deque of (seq, kind, frame, size, arrival)
+        self._rooms: Dict[int, deque] = {}
+        self._room_size: Dict[int, int] = {}
+        self._arrivals = 0
+
+    def append(self, room_id: int, obj: dict, kind: Optional[str]) -> Frame:
+        """Number a frame for the room and keep it; returns the numbered frame to send."""
+        seq = self.head.get(room_id, 0) + 1
+        self.head[room_id] = seq
+        frame = Frame({**obj, "seq": seq})
+        size = len(frame.text)
+        self._arrivals += 1
+        self._rooms.setdefault(room_id, deque()).append((seq, kind, frame, size, self._arrivals))
+        self._room_size[room_id] = self._room_size.get(room_id, 0) + size
+        self.bytes += size
+        ring = self._rooms[room_id]
+        while ring and (len(ring) > self.max_frames or self._room_size[room_id] > self.room_bytes):
+            self._evict(room_id)
+        while self.bytes > self.total_bytes and self._rooms:
+            oldest = min(self._rooms, key=lambda r: self._rooms[r][0][4])
+            self._evict(oldest)
+        return frame
+
+    def _evict(self, room_id: int):
+        ring = self._rooms[room_id]
+        *_, size, _ = ring.popleft()
+        self._room_size[room_id] -= size
+        self.bytes -= size
+        self.evicted += 1
+        if not ring:
+            del self._rooms[room_id]
+            del self._room_size[room_id]
+
+    def since(self, room_id: int, seq: int):
+        """
+        (kind, frame) pairs after `seq`, or None when they cannot all be
+        replayed (evicted, or a seq this worker never handed out).
+        """
+        head = self.head.get(room_id, 0)
+        if seq > head:
+            return None
+        ring = self._rooms.get(room_id, ())
+        missed = [(kind, frame) for s, kind, frame, *_ in ring if s > seq]
+        if len(missed) < head - seq:
+            return None
+        return missed
+
+    def forget(self, room_id: int):
+        while room_id in self._rooms:
+            self._evict(room_id)
+        self.head.pop(room_id, None)
+
+    def stats(self) -> dict:
+        return {"rooms": len(self._rooms), "bytes": self.bytes, "evicted": self.evicted}
+
+
+class ConnectionManager:
+    """Room membership and fan-out for the consultation WebSockets."""
+
+    def __init__(self, max_queue: int = None, send_timeout: float = None, stall_after: float = None,
+                 coalesce_ms: float = None, replay: ReplayLog = None):
+        self.max_queue = max_queue or settings.WS_SEND_QUEUE_SIZE
+        self.send_timeout = send_timeout or settings.WS_SEND_TIMEOUT
+        self.stall_after = stall_after or settings.WS_SEND_STALL_S
+        self.coalesce_window = (settings.WS_ICE_COALESCE_MS if coalesce_ms is None else coalesce_ms) / 1000
+        self.active_connections: Dict[int, Dict[WebSocket, ClientConnection]] = {}
+        self.dropped = 0
+        self.candidates_relayed = 0
+        self.candidate_batches = 0
+        # Sender socket -> (room_id, candidates waiting for the window to close, timer)
+        self._pending_candidates = {}
+        self.replay = replay or ReplayLog(
+            settings.WS_REPLAY_FRAMES, settings.WS_REPLAY_ROOM_BYTES, settings.WS_REPLAY_TOTAL_BYTES
+        )
+        self.broker: Broker = InMemoryBroker()
+        self.broker.deliver = self.deliver
+
+    async def use_broker(self, broker: Broker):
+        """Route room broadcasts through `broker` (called from the startup hook)."""
+        await self.broker.close()
+        self.broker = broker
+        await broker.start(self.deliver)
+
+    async def connect(self, websocket: WebSocket, room_id: int, batch_candidates: bool = False,
+                      since: Optional[int] = None):
+        """
+        Join the room. A reconnecting client passes the last `seq` it saw and
+        first receives the frames it missed, or a "resync" frame when they
+        are no longer buffered. Otherwise it is told the room's current seq.
+        """
+        subprotocol = negotiate(getattr(websocket, "scope", {}).get("subprotocols"))
+        if subprotocol:
+            await websocket.accept(subprotocol=subprotocol)
+        else:
+            await websocket.accept()
+        connection = ClientConnection(
+            websocket, self.max_queue, self.send_timeout, self.stall_after, subprotocol,
+            # Batches only exist while coalescing is on; otherwise everyone gets single candidates
+            batch_candidates=batch_candidates and self.coalesce_window > 0
+        )
+        # Nothing is published between here and joining the room, so the replay has no gap
+        if since is None:
+            connection.enqueue(Frame({"type": "sync", "seq": self.replay.head.get(room_id, 0)}))
+        else:
+            missed = self.replay.since(room_id, since)
+            if missed is None:
+                connection.enqueue(Frame({"type": "resync", "seq": self.replay.head.get(room_id, 0)}))
+            else:
+                for kind, frame in missed:
+                    connection.enqueue(frame, kind)
+        self.active_connections.setdefault(room_id, {})[websocket] = connection
+
+    def disconnect(self, websocket: WebSocket, room_id: int):
+        pending = self._pending_candidates.pop(websocket, None)
+        if pending is not None:
+            pending[2].cancel()
+        room = self.active_connections.get(room_id)
+        if room and websocket in room:
+            connection = room.pop(websocket)
+            self.dropped += connection.dropped
+            connection.close()
+
+    async def broadcast(self, message, room_id: int, kind: Optional[str] = None):
+        """Sends a message (dict, JSON text or Frame) to all users in the room"""
+        await self.broker.publish(room_id, Frame.of(message), kind)
+
+    async def broadcast_except(self, message, room_id: int, sender_socket: WebSocket,
+                               kind: Optional[str] = None):
+        """Sends a message to everyone EXCEPT the sender (for WebRTC signaling)"""
+        await self.broker.publish(room_id, Frame.of(message), kind, exclude=sender_socket)
+
+    def deliver(self, room_id: int, frame: Frame, kind: Optional[str] = None, exclude: WebSocket = None):
+        """Queue a published frame for this worker's sockets in the room."""
+        if kind not in UNREPLAYABLE:
+            frame = self._number(room_id, frame, kind)
+        for websocket, connection in list(self.active_connections.get(room_id, {}).items()):
+            if websocket is not exclude and connection.wants(kind):
+                connection.enqueue(frame, kind)
+
+    def _number(self, room_id: int, frame: Frame, kind: Optional[str]) -> Frame:
+        try:
+            obj = frame.obj
+        except ValueError:
+            return frame  # Not JSON: delivered as is, cannot carry a seq
+        if not isinstance(obj, dict):
+            return frame
+        return self.replay.append(room_id, obj, kind)
+
+    def forget_room(self, room_id: int):
+        """Drop the room's replay buffer once the consultation is over."""
+        self.replay.forget(room_id)
+
+    async def relay_candidate(self, frame: Frame, room_id: int, sender_socket: WebSocket):
+        """
+        Forward one trickle-ICE candidate: immediately to passthrough peers,
+        and into the sender's batch, which goes out as a single "candidates"
+        frame when the coalescing window closes.
+        """
+        self.candidates_relayed += 1
+        await self.broadcast_except(frame, room_id, sender_socket, kind="candidate")
+        if not self.coalesce_window:
+            return
+        pending = self._pending_candidates.get(sender_socket)
+        if pending is None:
+            timer = asyncio.get_running_loop().call_later(
+                self.coalesce_window, lambda: asyncio.ensure_future(self.flush_candidates(sender_socket))
+            )
+            pending = self._pending_candidates[sender_socket] = (room_id, [], timer)
+        pending[1].append(frame.obj)
+        if len(pending[1]) >= MAX_BATCHED_CANDIDATES:
+            await self.flush_candidates(sender_socket)
+
+    async def flush_candidates(self, sender_socket: WebSocket):
+        """Send the sender's pending batch now (also before its next offer/answer, to keep order)."""
+        pending = self._pending_candidates.pop(sender_socket, None)
+        if pending is None:
+            return
+        room_id, candidates, timer = pending
+        timer.cancel()
+        self.candidate_batches += 1
+        await self.broadcast_except({"type": "candidates", "candidates": candidates}, room_id, sender_socket,
+                                    kind="candidates")
+
+    def stats(self) -> dict:
+        connections = [c for room in self.active_connections.values() for c in room.values()]
+        return {
+            "rooms": len(self.active_connections),
+            "connections": len(connections),
+            "queued": sum(len(c.queue) for c in connections),
+            "dropped": self.dropped + sum(c.dropped for c in connections),
+            "candidates": {"relayed": self.candidates_relayed, "batches": self.candidate_batches},
+            "replay": self.replay.stats(),
+            "broker": self.broker.stats(),
+        }
+
+
+manager = ConnectionManager()
@@ -2,7 +2,7 @@ from sqlmodel import SQLModel, Session, create_engine
 from app.config import settings
 
 # Import models to ensure they're registered with SQLModel
-from app.models import User, Consultation, PrivacyLog  # noqa: F401
+from app.models import User, Consultation, PrivacyLog, TranscriptSegment  # noqa: F401
 
 # check_same_thread=False is needed only for SQLite
 engine = create_engine(settings.DATABASE_URL, connect_args={"check_same_thread": False})
@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+import asyncio
 import uvicorn
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse, HTMLResponse
@@ -9,13 +10,30 @@ from fastapi.exceptions import RequestValidationError
 from contextlib import asynccontextmanager
 import traceback
 
+from app.config import settings
 from app.database import init_db
+from app.transcription import transcription_executor, transcription_scheduler, warm_up
+from app.transcription_service import get_service_client
+from app.broker import get_broker
+from app.connections import manager
 from app.routers import auth, admin, workflow
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    # Room broadcasts reach sockets on every worker
+    await manager.use_broker(get_broker())
+    transcription_scheduler.service = get_service_client()
+    if settings.WHISPER_PRELOAD and transcription_scheduler.service is None:
+        # Load, calibrate and warm the models before the first patient arrives
+        # (in the pool processes themselves when TRANSCRIBE_POOL=process)
+        await asyncio.to_thread(warm_up)
     yield
+    transcription_scheduler.shutdown()
+    if transcription_scheduler.service is not None:
+        transcription_scheduler.service.close()
+    transcription_executor.shutdown(wait=False)
+    await manager.broker.close()
 
 app = FastAPI(title="ClinicVault Enterprise", lifespan=lifespan)
 
@@ -58,7 +58,7 @@ class Consultation(SQLModel, table=True):
     # Encrypted Fields (PHI)
     symptoms_enc: str 
     notes_enc: Optional[str] = None
-    transcript_enc: Optional[str] = None  # Stores the full transcript
+    transcript_enc: Optional[str] = None  # Legacy single-blob transcript; new chunks go to TranscriptSegment
     
     # Payment information
     payment_amount: Optional[float] = None
@@ -73,6 +73,23 @@ class Consultation(SQLModel, table=True):
         Index('idx_consultation_patient_created', 'patient_id', 'created_at'),
     )
 
+class TranscriptSegment(SQLModel, table=True):
+    """One encrypted transcript chunk. Rows are only ever appended, never rewritten."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    consultation_id: int = Field(foreign_key="consultation.id", index=True)
+    speaker_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    sequence: int
+    created_at: datetime = Field(default_factory=datetime.utcnow, sa_column=Column(DateTime, default=datetime.utcnow))
+    # Where the chunk's audio falls in the consultation, in ms since it started
+    start_ms: Optional[int] = None
+    end_ms: Optional[int] = None
+    text_enc: str
+
+    # Ordered reads and next-sequence lookups stay index-only however long the session runs
+    __table_args__ = (
+        Index('idx_transcript_consultation_sequence', 'consultation_id', 'sequence', unique=True),
+    )
+
 class PrivacyLog(SQLModel, table=True):
     """Immutable Audit Trail for HIPAA Compliance"""
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -6,6 +6,7 @@ from app.database import get_db
 from app.models import User, UserRole, DoctorStatus, PrivacyLog, Consultation, ConsultationStatus
 from app.security import get_current_user_from_token, pwd_context, audit_log
 from app.templates import render_template
+from app.transcription import transcription_stats, transcription_scheduler
 
 router = APIRouter()
 
@@ -207,4 +208,52 @@ async def delete_logs(
             "message": f"Successfully deleted {deleted_count} log(s)"
         })
     
-    return RedirectResponse("/dashboard", status_code=303)
\ No newline at end of file
+    return RedirectResponse("/dashboard", status_code=303)
+
+@router.get("/admin/transcription/stats")
+async def transcription_pipeline_stats(request: Request, session: Session = Depends(get_db)):
+    """Transcription pipeline counters (admin only)"""
+    token = request.cookies.get("access_token")
+    if not token:
+        return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+    
+    try:
+        admin = await get_current_user_from_token(token, session)
+    except Exception:
+        return JSONResponse(status_code=401, content={"error": "Invalid token"})
+    
+    if admin.role != UserRole.ADMIN:
+        return JSONResponse(status_code=403, content={"error": "Only administrators can view transcription stats"})
+    
+    return JSONResponse(content=transcription_stats())
+
+@router.post("/admin/transcription/weight")
+async def set_transcription_weight(
+    request: Request,
+    consultation_id: int = Form(...),
+    weight: int = Form(...),
+    session: Session = Depends(get_db)
+):
+    """Give a consultation more transcription chunks per scheduling turn (admin only); 1 restores the default"""
+    token = request.cookies.get("access_token")
+    if not token:
+        return JSONResponse(status_code=401, content={"error": "Unauthorized"})
+    
+    try:
+        admin = await get_current_user_from_token(token, session)
+    except Exception:
+        return JSONResponse(status_code=401, content={"error": "Invalid token"})
+    
+    if admin.role != UserRole.ADMIN:
+        return JSONResponse(status_code=403, content={"error": "Only administrators can change transcription weights"})
+    
+    if not 1 <= weight <= transcription_scheduler.MAX_WEIGHT:
+        return JSONResponse(status_code=400, content={
+            "error": f"Weight must be between 1 and {transcription_scheduler.MAX_WEIGHT}"
+        })
+    if not session.get(Consultation, consultation_id):
+        return JSONResponse(status_code=404, content={"error": "Consultation not found"})
+    
+    transcription_scheduler.set_weight(consultation_id, weight)
+    audit_log(session, admin, "Set Transcription Weight", f"Weight {weight}", "Operations", consult_id=consultation_id)
+    return JSONResponse(content={"success": True, "consultation_id": consultation_id, "weight": weight})
@@ -1,18 +1,26 @@
-import shutil
 import os
 import json
+import asyncio
 import uuid
-from typing import List, Dict
+from collections import deque
+from typing import List, Dict, Optional
 from datetime import datetime
 from fastapi import APIRouter, Depends, Form, Request, WebSocket, WebSocketDisconnect, UploadFile, File
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from sqlmodel import Session, select, or_
 
-from app.database import get_db
+from app.database import get_db, engine
 from app.models import User, Consultation, ConsultationStatus, DoctorStatus, UserRole, PrivacyLog
 from app.security import get_current_user, get_current_user_from_token, encrypt_phi, decrypt_phi, audit_log
 from app.templates import render_template
-from app.transcription import transcribe_audio_chunk
+from app.transcripts import append_transcript_segment, LazyTranscript
+from app.transcription import (
+    transcription_scheduler, chunk_cache, decode_params, voice_gate, prepare_chunk,
+    AudioStream, TranscriptionBusy, TranscriptionTimeout, TranscriptionDropped
+)
+from app.connections import manager
+from app.codec import Frame, loads
+from app.config import settings
 
 router = APIRouter()
 
@@ -236,7 +244,6 @@ async def consultation_room(request: Request, consult_id: int, session: Session
             # Decrypt with better error handling (decrypt_phi now returns empty string on error)
             symptoms_dec = decrypt_phi(pc.symptoms_enc) if pc.symptoms_enc else ""
             notes_dec = decrypt_phi(pc.notes_enc) if pc.notes_enc else ""
-            transcript_dec = decrypt_phi(pc.transcript_enc) if pc.transcript_enc else None
             
             # If decryption failed (empty string), show user-friendly message
             # This can happen if encryption key changed or data is corrupted
@@ -244,9 +251,6 @@ async def consultation_room(request: Request, consult_id: int, session: Session
                 symptoms_dec = "Unable to decrypt symptoms data."
             if not notes_dec:
                 notes_dec = "Unable to decrypt clinical notes."
-            if not transcript_dec:
-                transcript_dec = None
-            
             # Parse prescriptions and files from notes
             prescriptions = []
             files = []
@@ -294,7 +298,14 @@ async def consultation_room(request: Request, consult_id: int, session: Session
                 "notes": clinical_notes if clinical_notes else "No clinical notes recorded.",
                 "prescriptions": prescriptions,
                 "files": files,
-                "transcript": transcript_dec
+                # Assembled from encrypted segments only if the template renders it
+                "transcript": LazyTranscript(
+                    session, pc.id, legacy_enc=pc.transcript_enc,
+                    speakers={
+                        pc.doctor_id: doc.full_name if doc else "Doctor",
+                        pc.patient_id: patient.full_name if patient else "Patient"
+                    }
+                )
             })
     
     # Get current doctor and patient info
@@ -537,6 +548,8 @@ async def end_consultation(request: Request, consult_id: int, session: Session =
         session.add(doctor)
         session.commit()
         audit_log(session, user, "Ended Consultation", f"Consultation #{consult_id}", "Session Management", consult_id)
+    close_audio_uplinks(consult_id)
+    manager.forget_room(consult_id)
     
     return RedirectResponse("/dashboard", status_code=303)
 
@@ -551,46 +564,214 @@ async def toggle_status(request: Request, session: Session = Depends(get_db)):
     return RedirectResponse("/dashboard")
 
 # --- WebSocket & Transcription ---
-class ConnectionManager:
-    def __init__(self): self.active_connections: Dict[int, List[WebSocket]] = {}
-    async def connect(self, websocket: WebSocket, room_id: int):
-        await websocket.accept()
-        if room_id not in self.active_connections: self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
-    
-    def disconnect(self, websocket: WebSocket, room_id: int):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
-
-    async def broadcast(self, message: str, room_id: int):
-        """Sends a message to all users in the room"""
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]: 
-                await connection.send_text(message)
-
-    async def broadcast_except(self, message: str, room_id: int, sender_socket: WebSocket):
-        """Sends a message to everyone EXCEPT the sender (for WebRTC signaling)"""
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                if connection != sender_socket:
-                    await connection.send_text(message)
-
-manager = ConnectionManager()
+async def _transcribe_audio(consultation_id: int, audio, on_partial=None):
+    """Run the VAD gate, then batched transcription. Returns None for silent audio."""
+    # Silent chunks are dropped here instead of costing a model decode; the
+    # decode itself only starts once the scheduler has room for the chunk
+    with transcription_scheduler.admission(consultation_id):
+        audio, has_speech = await asyncio.to_thread(prepare_chunk, audio)
+    voice_gate.record(consultation_id, skipped=not has_speech)
+    if not has_speech:
+        return None
+    # Batched with chunks from other rooms and run on the transcription pool
+    return await transcription_scheduler.submit(consultation_id, audio, on_partial)
+
+def _is_transcript_speaker(session: Session, consultation_id: int, user_id: int) -> bool:
+    """Only the doctor or patient of an active consultation may add to its transcript."""
+    consult = session.get(Consultation, consultation_id)
+    return (consult is not None and consult.status == ConsultationStatus.ACTIVE
+            and user_id in (consult.patient_id, consult.doctor_id))
+
+async def _publish_transcript(session: Session, consultation_id: int, user_id: int, text: str,
+                              stream: Optional[str] = None, window: Optional[int] = None,
+                              spoken_until: Optional[datetime] = None, duration: Optional[float] = None):
+    """Broadcast a transcript line to the room and persist it. Returns False if it was refused."""
+    if not _is_transcript_speaker(session, consultation_id, user_id):
+        # Segments become part of the medical record: never from outside the consultation
+        print(f"[Transcription] Discarded text from user #{user_id} for consultation #{consultation_id}")
+        return False
+    payload = {
+        "type": "transcript",
+        "user_id": user_id,
+        "text": text
+    }
+    if window is not None:
+        # Final text for a streamed window; replaces its transcript_partial lines
+        payload["stream"] = stream
+        payload["window"] = window
+    await manager.broadcast(payload, consultation_id)
+    
+    # Persist as an append-only encrypted segment (O(1) per chunk)
+    append_transcript_segment(session, consultation_id, user_id, text, spoken_until, duration)
+    return True
+
+class AudioUplink:
+    """
+    One participant's audio streamed as binary frames on the consultation
+    WebSocket. The server cuts the stream into windows and transcribes them
+    in order on a background task; transcripts come back on the room sockets.
+    While a window is decoding, its running text is sent as transcript_partial.
+    """
+    MAX_PENDING_WINDOWS = 4
+
+    def __init__(self, consult_id: int, user_id: int):
+        self.consult_id = consult_id
+        self.user_id = user_id
+        self.stream = AudioStream(window_seconds=settings.TRANSCRIBE_STREAM_WINDOW_S)
+        # Live captions: when the transcriber falls behind, stale windows are dropped
+        self.windows = deque(maxlen=self.MAX_PENDING_WINDOWS)
+        self.worker = None
+        # Windows are numbered per stream; the id tells peers a new stream began
+        self.stream_id = uuid.uuid4().hex[:8]
+        self.window_seq = 0
+        self.partial_sends = set()
+        # (stream, window) of the last transcript_partial sent
+        self.partial_window = None
+        self.closed = False
+
+    def start(self, fmt: str = "webm"):
+        if self.closed:
+            return
+        # A new recording gets a fresh decoder; the old one is released
+        self.stream.close()
+        self.stream = AudioStream(fmt=fmt, window_seconds=settings.TRANSCRIBE_STREAM_WINDOW_S)
+        self.stream_id = uuid.uuid4().hex[:8]
+        self.window_seq = 0
+
+    def feed(self, data: bytes):
+        for window in self.stream.feed(data):
+            self._enqueue(window)
+
+    def stop(self):
+        window = self.stream.flush()
+        if window is not None:
+            self._enqueue(window)
+
+    def _enqueue(self, window):
+        if self.closed:
+            return
+        # Remember when the window was cut and how long it is, for the segment offsets
+        self.windows.append((window, datetime.utcnow(), self.stream.last_duration))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._run())
+
+    def _send_partial(self, stream: str, window: int, text: str):
+        self.partial_window = (stream, window)
+        msg = {
+            "type": "transcript_partial",
+            "user_id": self.user_id,
+            "stream": stream,
+            "window": window,
+            "text": text
+        }
+        task = asyncio.ensure_future(manager.broadcast(msg, self.consult_id, kind="transcript_partial"))
+        self.partial_sends.add(task)
+        task.add_done_callback(self.partial_sends.discard)
+
+    async def _run(self):
+        while self.windows:
+            window, spoken_until, duration = self.windows.popleft()
+            self.window_seq += 1
+            stream, seq = self.stream_id, self.window_seq
+            published = False
+            try:
+                text = await _transcribe_audio(
+                    self.consult_id, window, lambda partial: self._send_partial(stream, seq, partial)
+                )
+                if text:
+                    with Session(engine) as session:
+                        published = await _publish_transcript(
+                            session, self.consult_id, self.user_id, text, stream=stream, window=seq,
+                            spoken_until=spoken_until, duration=duration
+                        )
+            except (TranscriptionBusy, TranscriptionTimeout) as e:
+                print(f"[Transcription] Dropped streamed window for consultation #{self.consult_id}: {e}")
+            except Exception as e:
+                # One bad window must not end the participant's captions
+                print(f"[Transcription Error] Streamed window for consultation #{self.consult_id} failed: {e}")
+            if not published and self.partial_window == (stream, seq):
+                # Partials went out but no final text will: close the window so peers drop its interim line
+                await manager.broadcast({
+                    "type": "transcript",
+                    "user_id": self.user_id,
+                    "stream": stream,
+                    "window": seq,
+                    "text": ""
+                }, self.consult_id)
+
+    def close(self):
+        # The socket loop may still hold this uplink: everything it feeds from now on is ignored
+        self.closed = True
+        self.windows.clear()
+        if self.worker is not None:
+            self.worker.cancel()
+        self.stream.close()
+        if audio_uplinks.get((self.consult_id, self.user_id)) is self:
+            del audio_uplinks[(self.consult_id, self.user_id)]
+
+# One live uplink (and decoder) per participant: {(consult_id, user_id): AudioUplink}
+audio_uplinks: Dict[tuple, AudioUplink] = {}
+
+def open_audio_uplink(consult_id: int, user_id: int) -> AudioUplink:
+    """The participant's uplink; a second socket from the same user replaces the first."""
+    previous = audio_uplinks.get((consult_id, user_id))
+    if previous is not None:
+        previous.close()
+    uplink = AudioUplink(consult_id, user_id)
+    audio_uplinks[(consult_id, user_id)] = uplink
+    return uplink
+
+def close_audio_uplinks(consult_id: int):
+    """Tear down every audio decoder of a consultation."""
+    for key in [key for key in audio_uplinks if key[0] == consult_id]:
+        audio_uplinks[key].close()
 
 @router.websocket("/ws/{consult_id}/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, consult_id: int, user_id: int):
-    """WebSocket endpoint for chat, signaling, and live transcript."""
-    await manager.connect(websocket, consult_id)
+async def websocket_endpoint(websocket: WebSocket, consult_id: int, user_id: int, candidates: bool = False,
+                             since: Optional[int] = None):
+    """
+    WebSocket endpoint for chat, signaling, and live transcript.
+    Binary frames carry the participant's audio stream for transcription.
+    `?candidates=1` asks for trickle-ICE candidates in batched "candidates" frames;
+    `?since=<seq>` replays the room frames missed while reconnecting.
+    """
+    await manager.connect(websocket, consult_id, batch_candidates=candidates, since=since)
+    uplink = open_audio_uplink(consult_id, user_id)
     try:
         while True:
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            
+            # Binary frame -> audio for the transcription stream
+            if message.get("bytes") is not None:
+                uplink.feed(message["bytes"])
+                continue
+            
+            data = message.get("text") or ""
             try:
-                msg_json = json.loads(data)
+                msg_json = loads(data)
+                if not isinstance(msg_json, dict):
+                    raise json.JSONDecodeError("Not a JSON object", data, 0)
                 msg_type = msg_json.get("type")
 
-                # WebRTC signaling should not echo back to sender
-                if msg_type in {"offer", "answer", "candidate"}:
-                    await manager.broadcast_except(data, consult_id, websocket)
+                # Audio stream control is handled here, never broadcast
+                if msg_type == "audio_start":
+                    uplink.start(msg_json.get("format", "webm"))
+                    continue
+                if msg_type == "audio_stop":
+                    uplink.stop()
+                    continue
+
+                # WebRTC signaling should not echo back to sender; forwarded as
+                # received, the client's text is sent on without re-encoding
+                if msg_type == "candidate":
+                    await manager.relay_candidate(Frame(msg_json, data), consult_id, websocket)
+                    continue
+                if msg_type in {"offer", "answer"}:
+                    # Candidates this sender already trickled must not arrive after its new description
+                    await manager.flush_candidates(websocket)
+                    await manager.broadcast_except(Frame(msg_json, data), consult_id, websocket, kind=msg_type)
                     continue
 
                 # Structured chat message
@@ -598,23 +779,40 @@ async def websocket_endpoint(websocket: WebSocket, consult_id: int, user_id: int
                     # Ensure sender metadata is present
                     msg_json.setdefault("user_id", user_id)
                     msg_json.setdefault("timestamp", datetime.utcnow().isoformat())
-                    await manager.broadcast(json.dumps(msg_json), consult_id)
+                    await manager.broadcast(msg_json, consult_id)
                     continue
 
                 # Unknown structured message – broadcast as-is
-                await manager.broadcast(data, consult_id)
+                await manager.broadcast(Frame(msg_json, data), consult_id)
 
             except json.JSONDecodeError:
                 # Plain text fallback -> wrap into chat payload
-                chat_payload = json.dumps({
+                chat_payload = {
                     "type": "chat",
                     "user_id": user_id,
                     "text": data,
                     "timestamp": datetime.utcnow().isoformat()
-                })
+                }
                 await manager.broadcast(chat_payload, consult_id)
     except WebSocketDisconnect:
         manager.disconnect(websocket, consult_id)
+    finally:
+        uplink.close()
+
+def _transcription_error_response(e: Exception):
+    """HTTP answer for a chunk the transcription pipeline could not take."""
+    if isinstance(e, TranscriptionDropped):
+        # Discarded on purpose as stale: tell the client not to resend it
+        return {"status": "ok", "text": "", "dropped": True}
+    if isinstance(e, TranscriptionBusy):
+        return JSONResponse(
+            status_code=429,
+            headers={"Retry-After": str(e.retry_after)},
+            content={"error": "Transcription is busy, please retry shortly"}
+        )
+    if isinstance(e, TranscriptionTimeout):
+        return JSONResponse(status_code=504, content={"error": "Transcription timed out"})
+    raise e
 
 @router.post("/consultation/transcribe")
 async def transcribe_endpoint(
@@ -625,26 +823,44 @@ async def transcribe_endpoint(
 ):
     """Receives audio chunks, transcribes them, and broadcasts via WebSocket"""
     
-    # Save temp file
-    temp_filename = f"temp_{consultation_id}_{user_id}_{uuid.uuid4()}.webm"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(audio_blob.file, buffer)
+    if not _is_transcript_speaker(session, consultation_id, user_id):
+        return JSONResponse(status_code=403, content={"error": "Not a participant of an active consultation"})
+    
+    # Read the chunk from the upload spool; it is decoded from memory, never written to disk
+    audio_bytes = await audio_blob.read()
+    received_at = datetime.utcnow()
+    
+    # A retransmitted chunk was already decoded, broadcast and stored: just answer
+    cache_key = chunk_cache.key(audio_bytes, consultation_id, user_id, decode_params())
+    cached_text = chunk_cache.get(cache_key)
+    if cached_text is not None:
+        return {"status": "ok", "text": cached_text, "duplicate": True}
+    
+    # A retry sent while the first copy is still decoding shares that decode
+    in_flight = chunk_cache.claim(cache_key)
+    while in_flight is not None:
+        await asyncio.wait({in_flight})
+        if not in_flight.cancelled():
+            if in_flight.exception() is not None:
+                return _transcription_error_response(in_flight.exception())
+            return {"status": "ok", "text": in_flight.result(), "duplicate": True}
+        # The first request went away before finishing: decode it here instead
+        in_flight = chunk_cache.claim(cache_key)
     
-    # Run Faster Whisper
-    text = transcribe_audio_chunk(temp_filename)
+    try:
+        text = await _transcribe_audio(consultation_id, audio_bytes)
+    except BaseException as e:
+        chunk_cache.settle(cache_key, error=e)
+        if isinstance(e, (TranscriptionBusy, TranscriptionTimeout)):
+            return _transcription_error_response(e)
+        raise
+    
+    if text is None:
+        chunk_cache.settle(cache_key, "")
+        return {"status": "ok", "text": "", "skipped": True}
+    chunk_cache.settle(cache_key, text)
     
     if text:
-        # Prepare JSON message
-        msg = json.dumps({
-            "type": "transcript",
-            "user_id": user_id,
-            "text": text
-        })
-        # Broadcast via WebSocket
-        await manager.broadcast(msg, consultation_id)
-        
-        # Optionally: Append to DB transcript_enc (need to fetch, decrypt, append, encrypt, save)
-        # For performance in this loop, we might skip DB save for every chunk or do it async.
-        # Here we just audit log occasionally.
+        await _publish_transcript(session, consultation_id, user_id, text, spoken_until=received_at)
         
-    return {"status": "ok", "text": text}
\ No newline at end of file
+    return {"status": "ok", "text": text}
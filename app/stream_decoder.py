@@ -0,0 +1,215 @@
+"""
+Persistent decoding of one participant's streamed audio.
+
+A MediaRecorder WebM/Opus stream is one continuous container; decoding each
+window from scratch re-parses the header, re-creates the Opus decoder and
+resampler, and loses the codec state at every window edge (often mid-frame).
+Here the container is demuxed incrementally, packets go through one Opus
+decoder and one resampler for the life of the stream, and the 16 kHz mono
+PCM lands in a fixed-size ring buffer the transcriber reads windows from.
+"""
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import av
+    AV_AVAILABLE = True
+except ImportError:
+    AV_AVAILABLE = False
+
+SAMPLE_RATE = 16000
+
+# Matroska element IDs (with their length marker bits, as they appear on the wire)
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+CLUSTER = 0x1F43B675
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+SIMPLE_BLOCK = 0xA3
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+
+# Elements whose children we read; every other element is a leaf
+MASTER_ELEMENTS = {SEGMENT, CLUSTER, TRACKS, TRACK_ENTRY, BLOCK_GROUP}
+
+CODECS = {"A_OPUS": "opus", "A_VORBIS": "vorbis"}
+
+
+def stream_decoding_available(fmt: str) -> bool:
+    """Whether `fmt` streams can be decoded persistently in this environment."""
+    if np is None:
+        return False
+    return fmt == "pcm16" or AV_AVAILABLE
+
+
+def _read_vint(data, pos: int, keep_marker: bool) -> Tuple[Optional[int], int]:
+    """Read an EBML variable-length integer; returns (value, length) or (None, 0) if incomplete."""
+    if pos >= len(data):
+        return None, 0
+    first = data[pos]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ValueError("Invalid EBML variable-length integer")
+    if pos + length > len(data):
+        return None, 0
+    value = first if keep_marker else first & (0xFF >> length)
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        value = -1  # Unknown size (live streams leave Segment and Cluster open)
+    return value, length
+
+
+class WebmDemuxer:
+    """
+    Incremental Matroska/WebM demuxer for live MediaRecorder streams. Bytes
+    may be split anywhere; incomplete elements wait for the next feed.
+    Yields the raw audio packets of the first track.
+    """
+
+    def __init__(self):
+        self.codec_id = None
+        self.codec_private = None
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[bytes]:
+        self._buffer.extend(data)
+        packets = []
+        pos = 0
+        buffer = self._buffer
+        while True:
+            element_id, id_len = _read_vint(buffer, pos, keep_marker=True)
+            if element_id is None:
+                break
+            size, size_len = _read_vint(buffer, pos + id_len, keep_marker=False)
+            if size is None:
+                break
+            body = pos + id_len + size_len
+            if element_id in MASTER_ELEMENTS:
+                # Step into the element; its children follow in the stream
+                pos = body
+                continue
+            if size < 0 or body + size > len(buffer):
+                break
+            payload = bytes(buffer[body:body + size])
+            pos = body + size
+            if element_id in (SIMPLE_BLOCK, BLOCK):
+                packet = self._block_payload(payload)
+                if packet:
+                    packets.append(packet)
+            elif element_id == CODEC_ID:
+                self.codec_id = payload.rstrip(b"\x00").decode("ascii", "replace")
+            elif element_id == CODEC_PRIVATE:
+                self.codec_private = payload
+        del buffer[:pos]
+        return packets
+
+    @staticmethod
+    def _block_payload(payload: bytes) -> Optional[bytes]:
+        track, track_len = _read_vint(payload, 0, keep_marker=False)
+        if track is None or len(payload) < track_len + 3:
+            return None
+        flags = payload[track_len + 2]
+        if flags & 0x06:
+            # Laced blocks carry several frames; MediaRecorder does not write them
+            return None
+        return payload[track_len + 3:]
+
+
+class PcmRingBuffer:
+    """Fixed-size float32 ring of samples. When full, the oldest samples are overwritten."""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self._data = np.zeros(self.capacity, dtype=np.float32)
+        self._start = 0
+        self.available = 0
+        self.overwritten = 0
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        if len(samples) >= self.capacity:
+            self.overwritten += self.available + len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+            self._start, self.available = 0, 0
+        overflow = self.available + len(samples) - self.capacity
+        if overflow > 0:
+            self._start = (self._start + overflow) % self.capacity
+            self.available -= overflow
+            self.overwritten += overflow
+        end = (self._start + self.available) % self.capacity
+        first = min(len(samples), self.capacity - end)
+        self._data[end:end + first] = samples[:first]
+        self._data[:len(samples) - first] = samples[first:]
+        self.available += len(samples)
+
+    def read(self, count: int):
+        count = min(count, self.available)
+        indices = (self._start + np.arange(count)) % self.capacity
+        samples = self._data[indices]
+        self._start = (self._start + count) % self.capacity
+        self.available -= count
+        return samples
+
+
+class StreamDecoder:
+    """
+    Turns one stream's bytes into 16 kHz mono PCM in a ring buffer, keeping
+    the demuxer, codec and resampler alive across feeds. "pcm16" input is
+    already 16 kHz mono s16le and only needs converting; an odd trailing
+    byte is carried over to the next feed.
+    """
+
+    def __init__(self, fmt: str, capacity_samples: int):
+        if not stream_decoding_available(fmt):
+            raise RuntimeError(f"Persistent decoding of {fmt} streams is not available")
+        self.format = fmt
+        self.ring = PcmRingBuffer(capacity_samples)
+        self._carry = b""
+        self._demuxer = WebmDemuxer() if fmt == "webm" else None
+        self._codec = None
+        self._resampler = None
+
+    def feed(self, data: bytes):
+        if self.format == "pcm16":
+            data = self._carry + bytes(data)
+            usable = len(data) - len(data) % 2
+            self._carry = data[usable:]
+            if usable:
+                self.ring.write(np.frombuffer(data[:usable], dtype=np.int16).astype(np.float32) / 32768.0)
+            return
+        for packet in self._demuxer.feed(data):
+            self._decode(packet)
+
+    def _open_codec(self):
+        codec_name = CODECS.get(self._demuxer.codec_id or "A_OPUS", "opus")
+        self._codec = av.CodecContext.create(codec_name, "r")
+        if self._demuxer.codec_private:
+            self._codec.extradata = self._demuxer.codec_private
+        self._resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+
+    def _decode(self, packet: bytes):
+        if self._codec is None:
+            self._open_codec()
+        try:
+            frames = self._codec.decode(av.Packet(packet))
+        except Exception as e:
+            print(f"[Audio Stream] Skipping undecodable packet: {e}")
+            return
+        for frame in frames:
+            for resampled in self._resampler.resample(frame):
+                self.ring.write(resampled.to_ndarray().reshape(-1))
+
+    def close(self):
+        """Release the codec and resampler."""
+        self._codec = None
+        self._resampler = None
+        self._demuxer = None
@@ -1,63 +1,349 @@
+import io
 import os
+import time
+import hashlib
+import queue
+import asyncio
+import wave
+import tempfile
 import threading
+import functools
+from datetime import datetime
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import BinaryIO, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from app.config import settings
+from app.stream_decoder import StreamDecoder, stream_decoding_available
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 try:
-    from faster_whisper import WhisperModel
+    from faster_whisper import WhisperModel, decode_audio
+    from faster_whisper.audio import pad_or_trim
+    from faster_whisper.tokenizer import Tokenizer
+    from faster_whisper.transcribe import get_suppressed_tokens
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
     WHISPER_AVAILABLE = True
 except ImportError:
     WHISPER_AVAILABLE = False
     WhisperModel = None
 
+# Phrases Whisper tends to hallucinate on near-silent audio
+HALLUCINATION_BLACKLIST = {
+    "you",
+    "thank you",
+    "thanks",
+    "watching",
+    "subscribe",
+    "subtitle by",
+    ".",
+    ""
+}
+
 # -------------------------------
-# Thread-safe global model cache
+# Thread-safe model pool
 # -------------------------------
-_model = None
+class ModelPool:
+    """
+    A fixed set of loaded WhisperModel instances. Each transcription call
+    checks one out exclusively, so N instances serve N concurrent workers
+    without sharing a CTranslate2 thread pool.
+    """
+
+    def __init__(self, models: list, threads: int):
+        self.models = list(models)
+        self.threads = threads
+        self._idle = queue.Queue()
+        for model in self.models:
+            self._idle.put(model)
+
+    @property
+    def instances(self) -> int:
+        return len(self.models)
+
+    @contextmanager
+    def acquire(self):
+        model = self._idle.get()
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+
+_model_pool = None
+_light_pools = {}
 _model_lock = threading.Lock()
 
-def get_model():
+
+def _load_model(threads: int, model_name: Optional[str] = None):
+    return WhisperModel(
+        model_name or settings.WHISPER_MODEL,
+        device="cpu",
+        compute_type=settings.WHISPER_COMPUTE_TYPE,
+        cpu_threads=threads,
+        num_workers=1
+    )
+
+
+def _thread_budget() -> int:
+    """CPU threads Whisper may use in total; half the cores are left for the web workers."""
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+def _default_split():
+    instances = settings.WHISPER_INSTANCES or 1
+    threads = settings.WHISPER_THREADS or max(1, _thread_budget() // instances)
+    return instances, threads
+
+
+def _synthetic_clip(seconds: float, silent: bool = False):
+    """A deterministic 16 kHz clip: silence for warm-up, a voiced-like tone for calibration."""
+    samples = int(16000 * seconds)
+    if silent:
+        return np.zeros(samples, dtype=np.float32)
+    t = np.arange(samples, dtype=np.float32) / 16000
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    noise = np.random.default_rng(0).normal(0, 0.02, samples)
+    return (tone + noise).astype(np.float32)
+
+
+def _run_clip(model, clip):
+    segments, _ = model.transcribe(
+        clip, language="en", beam_size=1, vad_filter=False,
+        condition_on_previous_text=False, without_timestamps=True
+    )
+    for _ in segments:
+        pass
+
+
+def calibrate_model_pool(clip_seconds: float = 3.0, rounds: int = 2) -> ModelPool:
     """
-    Lazy-load and cache the Faster Whisper model (thread-safe).
-    Optimized for CPU-only, low-RAM environments.
+    Try a few instance/thread splits of the CPU budget on a synthetic clip and
+    keep the one with the best throughput (audio seconds decoded per second).
+    The winning instances are reused as the pool, so nothing is loaded twice.
     """
-    global _model
-    
+    budget = _thread_budget()
+    if settings.WHISPER_THREADS:
+        threads = settings.WHISPER_THREADS
+        candidates = [(n, threads) for n in (1, 2, 4) if n == 1 or n * threads <= max(budget, threads)]
+    else:
+        candidates = [(n, budget // n) for n in (1, 2, 4) if budget // n >= 1]
+
+    clip = _synthetic_clip(clip_seconds)
+    best, best_throughput = None, 0.0
+    for instances, threads in candidates:
+        models = [_load_model(threads) for _ in range(instances)]
+        for model in models:
+            _run_clip(model, clip)  # First call pays one-off allocation costs
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=instances) as pool:
+            list(pool.map(lambda m: [_run_clip(m, clip) for _ in range(rounds)], models))
+        elapsed = time.perf_counter() - start
+
+        throughput = instances * rounds * clip_seconds / elapsed
+        print(f"[Whisper Calibration] {instances} x {threads} threads: {throughput:.1f}x realtime")
+        if throughput > best_throughput:
+            best, best_throughput = ModelPool(models, threads), throughput
+
+    print(f"[Whisper Calibration] Using {best.instances} instance(s) x {best.threads} thread(s)")
+    return best
+
+
+def get_model_pool(autotune: bool = False) -> Optional[ModelPool]:
+    """
+    Lazy-load and cache the Faster Whisper model pool (thread-safe).
+    Model name, compute type and the instance/thread split come from Settings;
+    with WHISPER_INSTANCES=0 the split is calibrated when `autotune` is set.
+    """
+    global _model_pool
+
     if not WHISPER_AVAILABLE:
         print("[Warning] faster-whisper not installed. Transcription disabled.")
         return None
 
-    if _model is None:
+    if _model_pool is None:
         with _model_lock:
-            if _model is None:  # Double-check locking
-                print("Loading Faster Whisper Model (tiny.en | CPU | int8)...")
+            if _model_pool is None:  # Double-check locking
                 try:
-                    _model = WhisperModel(
-                        "base",
-                        device="cpu",
-                        compute_type="int8",
-                        cpu_threads=max(1, os.cpu_count() // 2),
-                        num_workers=1
-                    )
+                    if autotune and not settings.WHISPER_INSTANCES:
+                        _model_pool = calibrate_model_pool()
+                    else:
+                        instances, threads = _default_split()
+                        print(f"Loading Faster Whisper Model ({settings.WHISPER_MODEL} | CPU | "
+                              f"{settings.WHISPER_COMPUTE_TYPE} | {instances} x {threads} threads)...")
+                        _model_pool = ModelPool([_load_model(threads) for _ in range(instances)], threads)
                     print("Model loaded successfully.")
                 except Exception as e:
                     print(f"[WhisperModel Error] {e}")
                     return None
-    return _model
+    return _model_pool
 
 
-def transcribe_audio_chunk(file_path: str) -> str:
+def get_light_model_pool(model_name: str) -> Optional[ModelPool]:
     """
-    Transcribe an audio chunk with aggressive silence removal
-    and hallucination filtering.
+    Lazy-load a pool of a smaller model for the degraded quality tier, with
+    the same instance/thread split as the main pool.
     """
-    model = get_model()
-    if model is None:
-        return ""
+    main = get_model_pool()
+    if main is None:
+        return None
+    if model_name not in _light_pools:
+        with _model_lock:
+            if model_name not in _light_pools:
+                try:
+                    print(f"Loading light Faster Whisper Model ({model_name} | {main.instances} x {main.threads} threads)...")
+                    _light_pools[model_name] = ModelPool(
+                        [_load_model(main.threads, model_name) for _ in range(main.instances)], main.threads
+                    )
+                except Exception as e:
+                    # Remember the failure: retrying the load on every degraded batch
+                    # would hold _model_lock at exactly the worst time
+                    print(f"[WhisperModel Error] {e}; the light tier will use the main model")
+                    _light_pools[model_name] = main
+    return _light_pools[model_name]
 
-    if not os.path.exists(file_path):
-        return ""
 
-    try:
+@contextmanager
+def acquire_model(model_name: Optional[str] = None):
+    """
+    Check out one model instance for the duration of a decode (None if unavailable).
+    `model_name` selects a light model for a degraded quality tier.
+    """
+    pool = get_light_model_pool(model_name) if model_name else get_model_pool()
+    if pool is None:
+        yield None
+        return
+    with pool.acquire() as model:
+        yield model
+
+
+def _warm_pool(pool: ModelPool):
+    clip = _synthetic_clip(1.0, silent=True)
+    for model in pool.models:
+        try:
+            _run_clip(model, clip)
+        except Exception as e:
+            print(f"[WhisperModel Warm-up Error] {e}")
+
+
+def preload_models():
+    """
+    Load (and optionally calibrate) the model pool and warm every instance
+    with a short silent clip, so the first patient does not pay for it.
+    Sizes the transcription executor to the pool unless TRANSCRIBE_WORKERS is set.
+    """
+    pool = get_model_pool(autotune=True)
+    if pool is None:
+        return
+    _warm_pool(pool)
+    if not settings.TRANSCRIBE_WORKERS:
+        transcription_executor.resize(pool.instances)
+    print(f"Warmed up {pool.instances} Whisper instance(s).")
+    # Load the degraded tier's model now rather than at peak load
+    if settings.TRANSCRIBE_ADAPTIVE and settings.TRANSCRIBE_LIGHT_MODEL:
+        get_light_model_pool(settings.TRANSCRIBE_LIGHT_MODEL)
+
+
+def warm_worker_process():
+    """Process pool initializer: each pool process loads and warms its own models."""
+    pool = get_model_pool()
+    if pool is not None:
+        _warm_pool(pool)
+        print(f"[Transcription Worker {os.getpid()}] Warmed up {pool.instances} Whisper instance(s).")
+
+
+def warm_up():
+    """
+    WHISPER_PRELOAD: warm whatever serves the requests. In process mode the
+    parent never decodes, so every pool process is started and warmed instead.
+    """
+    if transcription_executor.mode == "process":
+        transcription_executor.prewarm(warm_worker_process)
+    else:
+        preload_models()
+
+
+# -------------------------------
+# In-memory audio sources
+# -------------------------------
+@contextmanager
+def open_audio_source(audio: Union[bytes, bytearray, memoryview, BinaryIO, str]):
+    """
+    Yield something the decoder can read without touching the working directory.
+
+    Bytes and file-like objects (e.g. the UploadFile spool) are decoded straight
+    from memory. Decoders that insist on a path can be served from an anonymous
+    memfd or a tmpfs file instead by setting TRANSCRIBE_SPOOL.
+    """
+    if isinstance(audio, str) or (np is not None and isinstance(audio, np.ndarray)):
+        # Paths and already-decoded PCM go to the model as they are
+        yield audio
+        return
+
+    spool = settings.TRANSCRIBE_SPOOL
+    if spool == "memory":
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            yield io.BytesIO(audio)
+        else:
+            if audio.seekable():
+                audio.seek(0)
+            yield audio
+        return
+
+    data = audio if isinstance(audio, (bytes, bytearray, memoryview)) else audio.read()
+
+    if spool == "memfd" and hasattr(os, "memfd_create"):
+        fd = os.memfd_create("clinicvault-audio", os.MFD_CLOEXEC)
+        try:
+            view = memoryview(data)
+            while view:
+                written = os.write(fd, view)
+                view = view[written:]
+            yield f"/proc/self/fd/{fd}"
+        finally:
+            os.close(fd)
+        return
+
+    if spool in ("memfd", "tmpfs"):
+        # tmpfs is RAM-backed, so this never hits the disk; also the memfd fallback
+        with tempfile.NamedTemporaryFile(dir=settings.TRANSCRIBE_TMPFS_DIR, suffix=".webm") as f:
+            f.write(data)
+            f.flush()
+            yield f.name
+        return
+
+    raise ValueError(f"Unknown transcription spool mode: {spool}")
+
+
+def _clean_segment(text: str, avg_logprob: float) -> Optional[str]:
+    """Apply confidence, length and hallucination filters to one decoded segment."""
+    text = text.strip()
+
+    # Confidence filter
+    if avg_logprob < -1.0:
+        return None
+
+    # Length filter
+    if len(text) < 2:
+        return None
+
+    # Hallucination blacklist
+    if text.lower() in HALLUCINATION_BLACKLIST:
+        return None
+
+    return text
+
+
+def _transcribe_one(model, audio, on_segment=None) -> str:
+    with open_audio_source(audio) as source:
         segments, info = model.transcribe(
-            file_path,
+            source,
             language="en",
             beam_size=1,                         # Fast greedy decoding
             vad_filter=True,                     # Skip silence
@@ -68,45 +354,968 @@ def transcribe_audio_chunk(file_path: str) -> str:
             temperature=0.0                     # Reduces hallucinations
         )
 
+        # segments is lazy, so it must be consumed while the source is open;
+        # each kept segment is reported as soon as the decoder produces it
         results = []
+        for seg in segments:
+            text = _clean_segment(seg.text, seg.avg_logprob)
+            if text:
+                results.append(text)
+                if on_segment is not None:
+                    on_segment(text)
 
-        for segment in segments:
-            text = segment.text.strip()
+    return " ".join(results)
 
-            # Confidence filter
-            if segment.avg_logprob < -1.0:
-                continue
 
-            # Length filter
-            if len(text) < 2:
-                continue
+def _acquire(model_name: Optional[str]):
+    return acquire_model(model_name) if model_name else acquire_model()
 
-            # Hallucination blacklist
-            blacklist = {
-                "you",
-                "thank you",
-                "thanks",
-                "watching",
-                "subscribe",
-                "subtitle by",
-                ".",
-                ""
-            }
 
-            if text.lower() in blacklist:
-                continue
+def transcribe_audio_chunk(audio: Union[bytes, bytearray, memoryview, BinaryIO, str], on_segment=None,
+                           model_name: Optional[str] = None) -> str:
+    """
+    Transcribe an audio chunk with aggressive silence removal
+    and hallucination filtering.
 
-            results.append(text)
+    `audio` is normally the raw chunk bytes; a file-like object or an
+    existing path are also accepted. Paths are never deleted here.
+    `on_segment(text)` is called for each segment as it is decoded.
+    `model_name` picks the light model of a degraded quality tier.
+    """
+    if audio is None or (hasattr(audio, "__len__") and len(audio) == 0):
+        return ""
 
-        return " ".join(results)
+    try:
+        with _acquire(model_name) as model:
+            if model is None:
+                return ""
+            return _transcribe_one(model, audio, on_segment)
 
     except Exception as e:
         print(f"[Transcription Error] {e}")
         return ""
 
-    finally:
-        # Always clean up temp files
+
+# -------------------------------
+# Batched inference
+# -------------------------------
+def decode_audio_chunk(audio: Union[bytes, bytearray, memoryview, BinaryIO, str]):
+    """Decode a chunk to 16 kHz mono float32 PCM."""
+    if np is not None and isinstance(audio, np.ndarray):
+        return audio
+    with open_audio_source(audio) as source:
+        return decode_audio(source, sampling_rate=16000)
+
+
+def _supports_native_batching(model) -> bool:
+    return all(hasattr(model, attr) for attr in ("feature_extractor", "hf_tokenizer", "encode", "model"))
+
+
+def _transcribe_pcm_batch(model, audios: list) -> List[str]:
+    """
+    Run one batched encoder pass and one batched greedy decode for several
+    short clips. Each clip must fit in a single 30s Whisper window.
+    """
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual, task="transcribe", language="en")
+    features = np.stack([
+        pad_or_trim(model.feature_extractor(audio)[..., :-1]) for audio in audios
+    ])
+    encoder_output = model.encode(features)
+
+    prompt = model.get_prompt(tokenizer, previous_tokens=[], without_timestamps=True)
+    results = model.model.generate(
+        encoder_output,
+        [list(prompt) for _ in audios],
+        beam_size=1,                         # Fast greedy decoding
+        max_length=model.max_length,
+        return_scores=True,
+        return_no_speech_prob=True,
+        suppress_blank=True,
+        suppress_tokens=get_suppressed_tokens(tokenizer, [-1]),
+        sampling_temperature=0.0             # Reduces hallucinations
+    )
+
+    texts = []
+    for result in results:
+        tokens = result.sequences_ids[0]
+        # Recover the average log prob the same way faster-whisper does
+        avg_logprob = result.scores[0] * len(tokens) / (len(tokens) + 1)
+        if result.no_speech_prob > 0.6 and avg_logprob < -1.0:
+            texts.append("")
+            continue
+        texts.append(_clean_segment(tokenizer.decode(tokens), avg_logprob) or "")
+    return texts
+
+
+def _segment_callback(on_segment, index: int):
+    if on_segment is None:
+        return None
+    return lambda text: on_segment(index, text)
+
+
+def transcribe_batch(chunks: list, on_segment=None, tier: Optional[str] = None) -> List[str]:
+    """
+    Transcribe several chunks (possibly from different consultations) at once.
+    Results are returned in input order. Falls back to one-by-one decoding
+    when the model cannot be batched or the batch fails.
+
+    `on_segment(index, text)` reports segments while chunks are decoded one
+    by one; a native batch finishes all chunks at once and reports none.
+    `tier` is the quality tier the scheduler picked for this batch.
+    """
+    model_name = QualityController.model_for(tier)
+    if len(chunks) <= 1:
+        return [transcribe_audio_chunk(chunk, _segment_callback(on_segment, i), model_name) for i, chunk in enumerate(chunks)]
+
+    with _acquire(model_name) as model:
+        if model is None:
+            return ["" for _ in chunks]
+        if _supports_native_batching(model):
+            return _transcribe_native_batch(model, chunks, on_segment)
+    return [transcribe_audio_chunk(chunk, _segment_callback(on_segment, i), model_name) for i, chunk in enumerate(chunks)]
+
+
+def trim_silence(audio):
+    """
+    Keep only the speech in 16 kHz PCM, using the same Silero VAD settings
+    as `vad_filter=True` on the one-by-one path, so batched and unbatched
+    chunks see the same audio.
+    """
+    stamps = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    if not stamps:
+        return audio[:0]
+    return np.concatenate([audio[stamp["start"]:stamp["end"]] for stamp in stamps])
+
+
+def _transcribe_native_batch(model, chunks: list, on_segment=None) -> List[str]:
+    texts = ["" for _ in chunks]
+    audios, positions = [], []
+    for i, chunk in enumerate(chunks):
+        try:
+            audio = trim_silence(decode_audio_chunk(chunk))
+        except Exception as e:
+            print(f"[Transcription Error] Could not decode chunk: {e}")
+            continue
+        # All silence: nothing to decode, the text stays ""
+        if len(audio):
+            audios.append(audio)
+            positions.append(i)
+
+    if not audios:
+        return texts
+
+    try:
+        for i, text in zip(positions, _transcribe_pcm_batch(model, audios)):
+            texts[i] = text
+    except Exception as e:
+        print(f"[Transcription Error] Batched decode failed, retrying one by one: {e}")
+        for i in positions:
+            try:
+                texts[i] = _transcribe_one(model, chunks[i], _segment_callback(on_segment, i))
+            except Exception as e:
+                print(f"[Transcription Error] {e}")
+    return texts
+
+
+# -------------------------------
+# Voice-activity gate
+# -------------------------------
+class VoiceActivityGate:
+    """
+    Cheap speech detector run on decoded PCM before a chunk is queued, so
+    silent chunks never cost a model decode. "energy" looks for enough 30ms
+    frames above a loudness threshold; "silero" uses faster-whisper's Silero
+    VAD. Counts checked/skipped chunks for the most recent consultations.
+    """
+
+    FRAME_MS = 30
+
+    def __init__(self, mode: str = "energy", threshold_db: float = -45.0,
+                 min_speech_ms: int = 200, silero_threshold: float = 0.5, max_tracked: int = 1024):
+        if mode not in ("energy", "silero", "off"):
+            raise ValueError(f"Unknown VAD mode: {mode}")
+        self.mode = mode
+        self.threshold_db = threshold_db
+        self.min_speech_ms = min_speech_ms
+        self.silero_threshold = silero_threshold
+        self.max_tracked = max_tracked
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def has_speech(self, pcm, threshold_offset_db: float = 0.0, min_speech_scale: float = 1.0) -> bool:
+        """
+        True if the PCM holds enough speech. The offset/scale tighten the gate
+        for degraded quality tiers (louder and longer speech required).
+        """
+        if self.mode == "off":
+            return True
+        min_speech_ms = self.min_speech_ms * min_speech_scale
+        if self.mode == "silero":
+            return bool(get_speech_timestamps(pcm, VadOptions(
+                threshold=min(0.95, self.silero_threshold + threshold_offset_db / 100),
+                min_speech_duration_ms=int(min_speech_ms)
+            )))
+
+        frame = 16000 * self.FRAME_MS // 1000
+        count = len(pcm) // frame
+        if count == 0:
+            return False
+        frames = np.asarray(pcm[:count * frame], dtype=np.float32).reshape(count, frame)
+        rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+        voiced = np.count_nonzero(20 * np.log10(rms) > self.threshold_db + threshold_offset_db)
+        return voiced * self.FRAME_MS >= min_speech_ms
+
+    def record(self, consultation_id: int, skipped: bool):
+        with self._lock:
+            counts = self._counts.pop(consultation_id, None) or {"checked": 0, "skipped": 0}
+            counts["checked"] += 1
+            counts["skipped"] += int(skipped)
+            self._counts[consultation_id] = counts
+            while len(self._counts) > self.max_tracked:
+                self._counts.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            per_room = {str(room): dict(counts) for room, counts in self._counts.items()}
+        return {
+            "mode": self.mode,
+            "decodes_saved": sum(c["skipped"] for c in per_room.values()),
+            "consultations": per_room
+        }
+
+
+voice_gate = VoiceActivityGate(
+    mode=settings.TRANSCRIBE_VAD,
+    threshold_db=settings.TRANSCRIBE_VAD_THRESHOLD_DB,
+    min_speech_ms=settings.TRANSCRIBE_VAD_MIN_SPEECH_MS
+)
+
+
+def prepare_chunk(audio):
+    """
+    Decode a chunk to PCM and run the voice-activity gate on it.
+    Returns (audio_for_the_model, has_speech). If the gate is off or the chunk
+    cannot be decoded here, the original bytes are passed on untouched.
+    """
+    if voice_gate.mode == "off" or not WHISPER_AVAILABLE:
+        return audio, True
+    try:
+        pcm = decode_audio_chunk(audio)
+    except Exception as e:
+        print(f"[Transcription Error] Could not decode chunk for VAD: {e}")
+        return audio, True
+    tier = quality_controller.tier
+    return pcm, voice_gate.has_speech(pcm, tier["vad_offset_db"], tier["min_speech_scale"])
+
+
+# -------------------------------
+# Bounded transcription executor
+# -------------------------------
+class TranscriptionBusy(Exception):
+    """Raised when the transcription pool and its queue are full."""
+    def __init__(self, retry_after: int):
+        super().__init__("Transcription queue is full")
+        self.retry_after = retry_after
+
+
+class TranscriptionTimeout(Exception):
+    """Raised when a chunk is not transcribed within the per-request timeout."""
+
+
+class TranscriptionServiceUnavailable(Exception):
+    """Raised when the shared transcription service cannot be reached; callers decode in-process."""
+
+
+def _worker_ready():
+    return os.getpid()
+
+
+class TranscriptionExecutor:
+    """
+    Runs blocking transcription calls on a dedicated thread or process pool
+    so the event loop stays free for HTTP and WebSocket traffic.
+
+    At most `max_workers + max_queue` calls are admitted at once; anything
+    beyond that is rejected immediately with TranscriptionBusy.
+    """
+
+    def __init__(self, mode: str = "thread", max_workers: int = 1, max_queue: int = 8,
+                 timeout: float = 30.0, retry_after: int = 2):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown transcription pool mode: {mode}")
+        self.mode = mode
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pool = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        # Runs once in every pool worker as it starts (see prewarm)
+        self.initializer = None
+
+    @property
+    def pending(self) -> int:
+        """Number of admitted calls that are queued or running."""
+        return self._pending
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.mode == "process":
+                        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=self.initializer)
+                    else:
+                        self._pool = ThreadPoolExecutor(
+                            max_workers=self.max_workers,
+                            thread_name_prefix="transcribe",
+                            initializer=self.initializer
+                        )
+        return self._pool
+
+    def resize(self, max_workers: int):
+        """Change the pool size; the new pool is created on the next call."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+            self.max_workers = max(1, max_workers)
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def prewarm(self, initializer):
+        """Recreate the pool with `initializer` and start all of its workers now."""
+        self.initializer = initializer
+        self.resize(self.max_workers)
+        pool = self._get_pool()
+        # Workers are spawned on demand: submitting one call each starts them all
+        for future in [pool.submit(_worker_ready) for _ in range(self.max_workers)]:
+            future.result()
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the pool and await its result."""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                raise TranscriptionBusy(self.retry_after)
+            self._pending += 1
+
         try:
-            os.remove(file_path)
+            future = self._get_pool().submit(fn, *args)
         except Exception:
-            pass
+            self._release()
+            raise
+        # The slot is freed when the work actually finishes, not when the
+        # caller stops waiting, so timeouts cannot oversubscribe the pool.
+        future.add_done_callback(self._release)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            future.cancel()  # Drops the call if it has not started yet
+            raise TranscriptionTimeout(f"Transcription exceeded {self.timeout}s")
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+transcription_executor = TranscriptionExecutor(
+    mode=settings.TRANSCRIBE_POOL,
+    max_workers=settings.TRANSCRIBE_WORKERS or settings.WHISPER_INSTANCES or 1,
+    max_queue=settings.TRANSCRIBE_MAX_QUEUE,
+    timeout=settings.TRANSCRIBE_TIMEOUT,
+    retry_after=settings.TRANSCRIBE_RETRY_AFTER
+)
+
+
+# -------------------------------
+# Load-adaptive quality tiers
+# -------------------------------
+class QualityController:
+    """
+    Picks the quality tier for new chunks from queue depth and the measured
+    real-time factor (decode seconds per second of audio). Under load it steps
+    down to a stricter VAD gate and then to a lighter model; when load falls
+    it steps back up. A tier is held for at least `dwell` seconds so it does
+    not flap, and every change is kept for the stats endpoint.
+    """
+
+    TIERS = (
+        {"name": "full", "model": None, "vad_offset_db": 0.0, "min_speech_scale": 1.0},
+        {"name": "reduced", "model": None, "vad_offset_db": 6.0, "min_speech_scale": 1.5},
+        {"name": "light", "model": settings.TRANSCRIBE_LIGHT_MODEL, "vad_offset_db": 10.0, "min_speech_scale": 2.0},
+    )
+
+    def __init__(self, enabled: bool = True, high_load: float = 0.75, low_load: float = 0.25,
+                 high_rtf: float = 0.8, low_rtf: float = 0.4, dwell: float = 10.0, light_model: bool = True):
+        self.enabled = enabled
+        self.high_load = high_load
+        self.low_load = low_load
+        self.high_rtf = high_rtf
+        self.low_rtf = low_rtf
+        self.dwell = dwell
+        self.tiers = self.TIERS if light_model else self.TIERS[:2]
+        self.level = 0
+        self.load = 0.0
+        self.rtf = 0.0
+        self.changes = 0
+        self.history = deque(maxlen=20)
+        self._changed_at = float("-inf")
+        self._lock = threading.Lock()
+
+    @property
+    def tier(self) -> dict:
+        return self.tiers[self.level]
+
+    @classmethod
+    def model_for(cls, tier: Optional[str]) -> Optional[str]:
+        """Model name of a tier (None means the main model)."""
+        for candidate in cls.TIERS:
+            if candidate["name"] == tier:
+                return candidate["model"]
+        return None
+
+    def observe_load(self, pending: int, capacity: int):
+        """Record queue depth as a fraction of what the queue can hold."""
+        self.load = pending / max(1, capacity)
+        self._evaluate()
+
+    def observe_decode(self, audio_seconds: float, elapsed: float):
+        """Record how long a batch took against how much audio it held."""
+        if audio_seconds <= 0:
+            return
+        # Smoothed so one slow batch does not switch tiers on its own
+        self.rtf = 0.7 * self.rtf + 0.3 * (elapsed / audio_seconds)
+        self._evaluate()
+
+    def _evaluate(self):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._changed_at < self.dwell:
+                return
+            if (self.load >= self.high_load or self.rtf >= self.high_rtf) and self.level < len(self.tiers) - 1:
+                self._set_level(self.level + 1, now)
+            elif self.load <= self.low_load and self.rtf <= self.low_rtf and self.level > 0:
+                self._set_level(self.level - 1, now)
+
+    def _set_level(self, level: int, now: float):
+        previous = self.tier["name"]
+        self.level = level
+        self.changes += 1
+        self._changed_at = now
+        self.history.append({
+            "at": datetime.utcnow().isoformat(), "from": previous, "to": self.tier["name"],
+            "load": round(self.load, 2), "rtf": round(self.rtf, 2)
+        })
+        print(f"[Transcription] Quality tier {previous} -> {self.tier['name']} "
+              f"(load {self.load:.2f}, rtf {self.rtf:.2f})")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled, "tier": self.tier["name"], "level": self.level,
+            "load": round(self.load, 3), "rtf": round(self.rtf, 3),
+            "changes": self.changes, "recent_changes": list(self.history)
+        }
+
+
+quality_controller = QualityController(
+    enabled=settings.TRANSCRIBE_ADAPTIVE,
+    high_rtf=settings.TRANSCRIBE_ADAPTIVE_HIGH_RTF,
+    dwell=settings.TRANSCRIBE_ADAPTIVE_DWELL_S,
+    light_model=bool(settings.TRANSCRIBE_LIGHT_MODEL)
+)
+
+
+def _audio_seconds(audios: list) -> float:
+    """Seconds of audio in a batch, counting the chunks already decoded to PCM."""
+    if np is None:
+        return 0.0
+    return sum(len(audio) / 16000 for audio in audios if isinstance(audio, np.ndarray))
+
+
+# -------------------------------
+# Cross-consultation micro-batching
+# -------------------------------
+class TranscriptionDropped(TranscriptionBusy):
+    """Raised for a queued chunk that was pushed out by newer audio from its room."""
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.args = ("Chunk dropped from the room's transcription backlog",)
+
+
+class TranscriptionScheduler:
+    """
+    Collects chunks from different consultations for up to `max_wait_ms`
+    (or until `max_batch_size` are waiting) and transcribes them as one batch
+    on the executor. Each caller gets back the text for its own chunk, so the
+    result is routed to the right consultation for broadcasting.
+
+    Every consultation has its own queue and batches are filled round-robin
+    across rooms (a room with weight N gets up to N chunks per turn), so a
+    room sending audio quickly cannot starve the others. A room holds at most
+    `max_room_backlog` chunks; past that its oldest chunk is dropped, since
+    stale captions are worth less than current ones.
+    """
+
+    MAX_WEIGHT = 8
+
+    def __init__(self, executor: TranscriptionExecutor, batch_fn=transcribe_batch,
+                 max_batch_size: int = 8, max_wait_ms: float = 40, max_pending: int = 8,
+                 max_room_backlog: int = 3, service=None, quality: Optional[QualityController] = None):
+        self.executor = executor
+        self.batch_fn = batch_fn
+        self.service = service
+        self.quality = quality
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_pending = max(1, max_pending)
+        self.max_room_backlog = max(1, max_room_backlog)
+        self.dropped = 0
+        # Chunks admitted but still being decoded and gated before submit()
+        self.preparing = 0
+        self._weights = {}
+        self._queues = OrderedDict()
+        self._loop = None
+        self._task = None
+        self._wakeup = None
+        self._slots = None
+
+    @property
+    def pending(self) -> int:
+        """Number of chunks waiting to be batched."""
+        return sum(len(q) for q in self._queues.values())
+
+    def backlog(self, consultation_id: int) -> int:
+        """Number of chunks waiting for one consultation."""
+        queue_ = self._queues.get(consultation_id)
+        return len(queue_) if queue_ else 0
+
+    def set_weight(self, consultation_id: int, weight: Optional[int]):
+        """Give a room more chunks per round-robin turn; None restores the default of 1."""
+        if weight is None or weight <= 1:
+            self._weights.pop(consultation_id, None)
+        else:
+            self._weights[consultation_id] = min(int(weight), self.MAX_WEIGHT)
+
+    @contextmanager
+    def admission(self, consultation_id: int):
+        """
+        Reserve room for a chunk before it is decoded and gated. Raises
+        TranscriptionBusy up front when the queue would refuse it anyway, so
+        a saturated pipeline does not pay for decodes it will reject.
+        """
+        room_full = self.backlog(consultation_id) >= self.max_room_backlog
+        if not room_full and self.pending + self.preparing >= self.max_pending:
+            raise TranscriptionBusy(self.executor.retry_after)
+        self.preparing += 1
+        try:
+            yield
+        finally:
+            self.preparing -= 1
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._queues = OrderedDict()
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.executor.max_workers)
+            self._task = loop.create_task(self._run())
+
+    async def submit(self, consultation_id: int, audio, on_partial=None) -> str:
+        """
+        Queue a chunk for the next batch and wait for its text.
+        `on_partial(text)` is called on the event loop with the running text
+        while the chunk is still being decoded.
+        """
+        self._ensure_started()
+        room = self._queues.get(consultation_id)
+        if room is not None and len(room) >= self.max_room_backlog:
+            stale = room.popleft()[2]
+            if not stale.done():
+                stale.set_exception(TranscriptionDropped(self.executor.retry_after))
+            self.dropped += 1
+        elif self.pending >= self.max_pending:
+            raise TranscriptionBusy(self.executor.retry_after)
+
+        if self.quality is not None:
+            self.quality.observe_load(self.pending + 1, self.max_pending)
+        future = self._loop.create_future()
+        if room is None:
+            room = self._queues[consultation_id] = deque()
+        room.append((consultation_id, audio, future, self._loop.time(), on_partial))
+        self._wakeup.set()
+        try:
+            return await asyncio.wait_for(future, self.executor.timeout + self.max_wait)
+        except asyncio.TimeoutError:
+            raise TranscriptionTimeout(f"Transcription exceeded {self.executor.timeout}s")
+
+    def _oldest(self) -> float:
+        return min(q[0][3] for q in self._queues.values() if q)
+
+    def _take_batch(self) -> list:
+        """Pop up to max_batch_size live chunks, one room turn at a time."""
+        batch = []
+        while len(batch) < self.max_batch_size and self._queues:
+            consultation_id, room = next(iter(self._queues.items()))
+            turn = self._weights.get(consultation_id, 1)
+            while room and turn and len(batch) < self.max_batch_size:
+                item = room.popleft()
+                if not item[2].done():
+                    batch.append(item)
+                    turn -= 1
+            if room:
+                self._queues.move_to_end(consultation_id)
+            else:
+                del self._queues[consultation_id]
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self.pending:
+                continue
+
+            # Only start filling a batch once a worker can take it; under load
+            # chunks keep accumulating meanwhile, which is what fills batches.
+            await self._slots.acquire()
+            deadline = self._oldest() + self.max_wait if self.pending else self._loop.time()
+            while self.pending < self.max_batch_size:
+                remaining = deadline - self._loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            if self.pending:
+                self._wakeup.set()
+            if not batch:
+                self._slots.release()
+                continue
+            self._loop.create_task(self._dispatch(batch))
+
+    def _partial_relay(self, listeners: list):
+        """Forward segments from the worker thread to each chunk's listener as running text."""
+        loop = self._loop
+        so_far = [[] for _ in listeners]
+
+        def on_segment(index: int, text: str):
+            if listeners[index] is not None:
+                so_far[index].append(text)
+                loop.call_soon_threadsafe(listeners[index], " ".join(so_far[index]))
+        return on_segment
+
+    async def _transcribe(self, audios: list, listeners: list) -> list:
+        # Degraded tier: the batch is decoded with that tier's model
+        tier = self.quality.tier["name"] if self.quality is not None and self.quality.level else None
+        if self.service is not None:
+            # Partials are not relayed from the shared service; finals only
+            try:
+                return await self.service.transcribe(audios, tier=tier)
+            except TranscriptionServiceUnavailable as e:
+                print(f"[Transcription] Service unavailable, decoding in-process: {e}")
+        fn = self.batch_fn
+        if tier is not None:
+            fn = functools.partial(fn, tier=tier)
+        if self.executor.mode == "thread" and any(listeners):
+            return await self.executor.run(fn, audios, self._partial_relay(listeners))
+        return await self.executor.run(fn, audios)
+
+    async def _dispatch(self, batch: list):
+        futures = [item[2] for item in batch]
+        audios = [item[1] for item in batch]
+        started = time.perf_counter()
+        try:
+            texts = await self._transcribe(audios, [item[4] for item in batch])
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            if self.quality is not None:
+                self.quality.observe_decode(_audio_seconds(audios), time.perf_counter() - started)
+            for future, text in zip(futures, texts):
+                if not future.done():
+                    future.set_result(text)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for room in self._queues.values():
+            for item in room:
+                if not item[2].done():
+                    item[2].cancel()
+        self._queues = OrderedDict()
+
+
+transcription_scheduler = TranscriptionScheduler(
+    transcription_executor,
+    max_batch_size=settings.TRANSCRIBE_BATCH_SIZE,
+    max_wait_ms=settings.TRANSCRIBE_BATCH_WAIT_MS,
+    max_pending=settings.TRANSCRIBE_MAX_QUEUE,
+    max_room_backlog=settings.TRANSCRIBE_ROOM_BACKLOG,
+    quality=quality_controller
+)
+
+
+# -------------------------------
+# Streamed audio windows
+# -------------------------------
+WEBM_CLUSTER_ID = b"\x1f\x43\xb6\x75"
+
+
+class AudioStream:
+    """
+    Buffers one participant's audio streamed over the WebSocket and cuts it
+    into windows for transcription, so the server picks window boundaries.
+
+    Where possible the stream is decoded persistently (see app.stream_decoder):
+    one demuxer, codec and resampler for the whole stream feed a PCM ring
+    buffer, and windows are cut from it on exact sample counts. Without
+    numpy/PyAV, "pcm16" windows are cut on byte counts, and "webm" windows
+    are cut on elapsed time with the container header (the start of the
+    stream's first message, up to its first Cluster) prefixed to each.
+    """
+
+    BYTES_PER_SECOND = 16000 * 2
+
+    def __init__(self, fmt: str = "webm", window_seconds: float = 3.0, max_buffered_windows: int = 4):
+        if fmt not in ("webm", "pcm16"):
+            raise ValueError(f"Unknown audio stream format: {fmt}")
+        self.format = fmt
+        self.window_seconds = window_seconds
+        self.max_buffered_bytes = int(self.BYTES_PER_SECOND * max(window_seconds, 1.0) * max_buffered_windows)
+        self.decoder = None
+        if stream_decoding_available(fmt):
+            self.decoder = StreamDecoder(fmt, self.max_buffered_bytes // 2)
+        self._header = None
+        self._buffer = bytearray()
+        self._window_started = None
+        # Seconds of audio in the most recently returned window
+        self.last_duration = None
+        self.closed = False
+
+    def feed(self, data: bytes) -> list:
+        """Add streamed bytes and return any windows that are now complete."""
+        if not data or self.closed:
+            return []
+        if self.decoder is not None:
+            return self._feed_decoded(data)
+        if self.format == "webm" and self._header is None:
+            # The first MediaRecorder blob is the EBML/Segment header followed by
+            # the first Cluster of audio; only the part before it is the header
+            data = bytes(data)
+            cluster = data.find(WEBM_CLUSTER_ID)
+            self._header = data if cluster < 0 else data[:cluster]
+            self._window_started = time.monotonic()
+            data = b"" if cluster < 0 else data[cluster:]
+            if not data:
+                return []
+
+        if self._window_started is None:
+            self._window_started = time.monotonic()
+        self._buffer.extend(data)
+        if len(self._buffer) > self.max_buffered_bytes:
+            # The transcriber cannot keep up with this stream: keep the newest audio
+            overflow = len(self._buffer) - self.max_buffered_bytes
+            if self.format == "pcm16":
+                overflow += overflow % 2
+            del self._buffer[:overflow]
+
+        windows = []
+        if self.format == "pcm16":
+            window_bytes = int(self.BYTES_PER_SECOND * self.window_seconds)
+            while len(self._buffer) >= window_bytes:
+                self.last_duration = window_bytes / self.BYTES_PER_SECOND
+                windows.append(self._pcm_window(self._buffer[:window_bytes]))
+                del self._buffer[:window_bytes]
+        elif time.monotonic() - self._window_started >= self.window_seconds:
+            windows.append(self._take_webm_window())
+        return windows
+
+    def _feed_decoded(self, data: bytes) -> list:
+        self.decoder.feed(data)
+        ring = self.decoder.ring
+        window_samples = max(1, int(16000 * self.window_seconds))
+        windows = []
+        while ring.available >= window_samples:
+            self.last_duration = window_samples / 16000
+            windows.append(ring.read(window_samples))
+        return windows
+
+    def flush(self):
+        """Return whatever is buffered as a final (possibly short) window."""
+        if self.closed:
+            return None
+        if self.decoder is not None:
+            ring = self.decoder.ring
+            if not ring.available:
+                return None
+            self.last_duration = ring.available / 16000
+            return ring.read(ring.available)
+        if not self._buffer:
+            return None
+        if self.format == "pcm16":
+            size = len(self._buffer) - len(self._buffer) % 2
+            self.last_duration = size / self.BYTES_PER_SECOND
+            window = self._pcm_window(self._buffer[:size])
+            self._buffer.clear()
+            return window
+        return self._take_webm_window()
+
+    def _take_webm_window(self) -> bytes:
+        window = self._header + bytes(self._buffer)
+        self._buffer.clear()
+        now = time.monotonic()
+        self.last_duration = now - self._window_started
+        self._window_started = now
+        return window
+
+    def close(self):
+        """Tear down the persistent decoder; later audio is ignored."""
+        self.closed = True
+        if self.decoder is not None:
+            self.decoder.close()
+            self.decoder = None
+        self._buffer.clear()
+
+    @staticmethod
+    def _pcm_window(data: bytearray):
+        if np is not None:
+            return np.frombuffer(bytes(data), dtype=np.int16).astype(np.float32) / 32768.0
+        # Without numpy, wrap the samples in a WAV container for the decoder
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(16000)
+            wav.writeframes(bytes(data))
+        return buffer.getvalue()
+
+
+# -------------------------------
+# Retransmitted chunk cache
+# -------------------------------
+def decode_params() -> tuple:
+    """Everything besides the audio that changes what a decode returns."""
+    return (settings.WHISPER_MODEL, settings.WHISPER_COMPUTE_TYPE, "en", 1)
+
+
+class ChunkCache:
+    """
+    Bounded LRU cache (with TTL) of transcripts for recently seen chunks, keyed
+    by a hash of the chunk bytes, its room/speaker and the decode parameters.
+    Browsers that re-POST a chunk after a timeout get the earlier text back
+    without paying for another Whisper decode. A retry that arrives while the
+    first copy is still decoding waits for that decode instead of starting
+    its own (see `claim`).
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 120):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(audio: bytes, consultation_id: int, user_id: int, params: tuple = ()) -> str:
+        digest = hashlib.blake2b(audio, digest_size=16)
+        digest.update(repr((consultation_id, user_id) + tuple(params)).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, text: str):
+        with self._lock:
+            self._entries[key] = (text, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def claim(self, key: str) -> Optional[asyncio.Future]:
+        """
+        Register the caller as the one decoding `key`. Returns None if it now
+        owns the decode (and must call `settle`), or the future of the decode
+        already in flight for the same chunk.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None and not future.done() and future.get_loop() is loop:
+                self.joined += 1
+                return future
+            self._inflight[key] = loop.create_future()
+            return None
+
+    def settle(self, key: str, text: Optional[str] = None, error: Optional[BaseException] = None):
+        """Finish an owned decode: cache the text and hand it (or the error) to waiting retries."""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if error is None:
+            self.put(key, text)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(text)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+            # Retries that gave up waiting must not log "exception never retrieved"
+            future.exception()
+        else:
+            future.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "in_flight": len(self._inflight), "joined": self.joined
+            }
+
+
+chunk_cache = ChunkCache(max_entries=settings.TRANSCRIBE_CACHE_SIZE, ttl=settings.TRANSCRIBE_CACHE_TTL)
+
+
+def transcription_stats() -> dict:
+    """Counters for the transcription pipeline, for the admin stats endpoint."""
+    return {
+        "executor": {"pending": transcription_executor.pending, "workers": transcription_executor.max_workers},
+        "scheduler": {
+            "pending": transcription_scheduler.pending,
+            "preparing": transcription_scheduler.preparing,
+            "rooms": len(transcription_scheduler._queues),
+            "dropped": transcription_scheduler.dropped,
+            "weights": {str(room): weight for room, weight in transcription_scheduler._weights.items()}
+        },
+        "cache": chunk_cache.stats(),
+        "quality": quality_controller.stats(),
+        "vad": voice_gate.stats()
+    }
@@ -0,0 +1,267 @@
+"""
+Shared transcription service.
+
+With `uvicorn --workers N` every worker would otherwise load its own Whisper
+models. In service mode one local process owns the models and the workers
+send it their batches over a Unix domain socket:
+
+    python -m app.transcription_service
+
+and start the web workers with TRANSCRIBE_SERVICE_SOCKET pointing at the same
+path. If the service cannot be reached, workers decode in-process.
+
+Wire format: every message is a frame `!BI` (kind, payload length) + payload.
+A TRANSCRIBE request carries `!B` length + the quality tier name (empty
+for full quality), `!H` chunk count, then per chunk `!BI` (encoding,
+length) + data, where the encoding is container bytes or float32 PCM. The reply is OK with a JSON list of texts, BUSY with the retry-after
+seconds, or ERROR with a message.
+"""
+import os
+import json
+import struct
+import asyncio
+import functools
+from typing import List, Optional
+
+from app.config import settings
+from app.transcription import (
+    np, transcribe_batch, transcription_executor, warm_up,
+    TranscriptionExecutor, TranscriptionBusy, TranscriptionTimeout, TranscriptionServiceUnavailable
+)
+
+FRAME = struct.Struct("!BI")
+COUNT = struct.Struct("!H")
+TIER = struct.Struct("!B")
+
+MSG_TRANSCRIBE = 1
+MSG_OK = 0
+MSG_BUSY = 2
+MSG_ERROR = 3
+
+AUDIO_ENCODED = 0
+AUDIO_PCM_F32 = 1
+
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+# -------------------------------
+# Framing
+# -------------------------------
+def encode_chunks(chunks: list) -> bytes:
+    """Pack a batch of audio chunks (bytes, file-likes or PCM arrays) into a request payload."""
+    parts = [COUNT.pack(len(chunks))]
+    for chunk in chunks:
+        if np is not None and isinstance(chunk, np.ndarray):
+            encoding, data = AUDIO_PCM_F32, chunk.astype(np.float32, copy=False).tobytes()
+        elif isinstance(chunk, str):
+            with open(chunk, "rb") as f:
+                encoding, data = AUDIO_ENCODED, f.read()
+        elif hasattr(chunk, "read"):
+            chunk.seek(0)
+            encoding, data = AUDIO_ENCODED, chunk.read()
+        else:
+            encoding, data = AUDIO_ENCODED, bytes(chunk)
+        parts.append(FRAME.pack(encoding, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def decode_chunks(payload: bytes) -> list:
+    """Unpack a request payload back into audio the local decoder accepts."""
+    view = memoryview(payload)
+    (count,), offset = COUNT.unpack_from(view), COUNT.size
+    chunks = []
+    for _ in range(count):
+        encoding, length = FRAME.unpack_from(view, offset)
+        offset += FRAME.size
+        data = bytes(view[offset:offset + length])
+        offset += length
+        if encoding == AUDIO_PCM_F32:
+            if np is None:
+                raise ValueError("PCM audio needs numpy on the service side")
+            chunks.append(np.frombuffer(data, dtype=np.float32))
+        else:
+            chunks.append(data)
+    return chunks
+
+
+def encode_request(chunks: list, tier: Optional[str] = None) -> bytes:
+    """A TRANSCRIBE payload: the quality tier the worker picked, then the chunks."""
+    name = (tier or "").encode()
+    return TIER.pack(len(name)) + name + encode_chunks(chunks)
+
+
+def decode_request(payload: bytes):
+    """Split a TRANSCRIBE payload into (tier or None, chunks)."""
+    (length,) = TIER.unpack_from(payload)
+    tier = payload[TIER.size:TIER.size + length].decode()
+    return tier or None, decode_chunks(payload[TIER.size + length:])
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    kind, length = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds the limit")
+    return kind, await reader.readexactly(length)
+
+
+def write_frame(writer: asyncio.StreamWriter, kind: int, payload: bytes):
+    writer.write(FRAME.pack(kind, len(payload)) + payload)
+
+
+# -------------------------------
+# Service (model owner)
+# -------------------------------
+class TranscriptionService:
+    """Serves batched transcription to local web workers over a Unix socket."""
+
+    def __init__(self, path: str, executor: TranscriptionExecutor = transcription_executor,
+                 batch_fn=transcribe_batch):
+        self.path = path
+        self.executor = executor
+        self.batch_fn = batch_fn
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+        print(f"[Transcription Service] Listening on {self.path}")
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # One connection per worker connection-pool slot, reused across requests
+        try:
+            while True:
+                try:
+                    kind, payload = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                if kind != MSG_TRANSCRIBE:
+                    write_frame(writer, MSG_ERROR, f"Unknown message kind {kind}".encode())
+                else:
+                    write_frame(writer, *await self._transcribe(payload))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            print(f"[Transcription Service] Dropping connection: {e}")
+        finally:
+            writer.close()
+
+    async def _transcribe(self, payload: bytes):
+        try:
+            tier, chunks = decode_request(payload)
+            # The worker's quality tier applies here too (a degraded tier may mean the light model)
+            fn = functools.partial(self.batch_fn, tier=tier) if tier else self.batch_fn
+            texts = await self.executor.run(fn, chunks)
+        except TranscriptionBusy as e:
+            return MSG_BUSY, json.dumps({"retry_after": e.retry_after}).encode()
+        except Exception as e:
+            return MSG_ERROR, str(e).encode()
+        return MSG_OK, json.dumps(texts).encode()
+
+
+# -------------------------------
+# Client (web workers)
+# -------------------------------
+class TranscriptionServiceClient:
+    """
+    Async client for the shared service. Connections are kept open and reused;
+    a stale connection is retried once on a fresh one before giving up.
+    """
+
+    def __init__(self, path: str, timeout: float = 30, max_idle: int = 4):
+        self.path = path
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._loop = None
+
+    async def _connect(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Streams belong to the loop that opened them
+            self._loop = loop
+            self._idle = []
+        if self._idle:
+            return self._idle.pop(), True
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.path)
+        except (OSError, ConnectionError) as e:
+            raise TranscriptionServiceUnavailable(str(e))
+        return (reader, writer), False
+
+    def _release(self, conn):
+        if len(self._idle) < self.max_idle and not conn[1].is_closing():
+            self._idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def transcribe(self, chunks: list, tier: Optional[str] = None) -> List[str]:
+        """Send one batch to the service and return its texts in order."""
+        payload = encode_request(chunks, tier)
+        for _ in range(2):
+            (reader, writer), reused = await self._connect()
+            try:
+                write_frame(writer, MSG_TRANSCRIBE, payload)
+                await writer.drain()
+                kind, body = await asyncio.wait_for(read_frame(reader), self.timeout)
+            except asyncio.TimeoutError:
+                writer.close()
+                raise TranscriptionTimeout(f"Transcription service exceeded {self.timeout}s")
+            except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused:
+                    continue
+                raise TranscriptionServiceUnavailable(str(e))
+            self._release((reader, writer))
+            break
+        else:
+            raise TranscriptionServiceUnavailable("Connection to the transcription service was lost")
+
+        if kind == MSG_OK:
+            return json.loads(body)
+        if kind == MSG_BUSY:
+            raise TranscriptionBusy(json.loads(body)["retry_after"])
+        # A failure inside the service: let the worker decode the batch itself
+        raise TranscriptionServiceUnavailable(f"Transcription service error: {body.decode(errors='replace')}")
+
+    def close(self):
+        for _, writer in self._idle:
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+        self._idle = []
+
+
+def get_service_client() -> Optional[TranscriptionServiceClient]:
+    """A client for TRANSCRIBE_SERVICE_SOCKET, or None to decode in-process."""
+    if not settings.TRANSCRIBE_SERVICE_SOCKET:
+        return None
+    return TranscriptionServiceClient(settings.TRANSCRIBE_SERVICE_SOCKET, timeout=settings.TRANSCRIBE_TIMEOUT)
+
+
+def main():
+    path = settings.TRANSCRIBE_SERVICE_SOCKET or "/tmp/clinicvault-transcribe.sock"
+    warm_up()
+    try:
+        asyncio.run(TranscriptionService(path).serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
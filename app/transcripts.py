@@ -0,0 +1,136 @@
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.models import TranscriptSegment, Consultation
+from app.security import encrypt_phi, decrypt_phi
+
+
+def _chunk_offsets(session: Session, consultation_id: int, spoken_until: Optional[datetime],
+                   duration: Optional[float]) -> Tuple[Optional[int], Optional[int]]:
+    """Offsets of a chunk within its consultation, in ms since the call started."""
+    consultation = session.get(Consultation, consultation_id)
+    origin = consultation and (consultation.started_at or consultation.created_at)
+    if origin is None:
+        return None, None
+    end_ms = max(0, int(((spoken_until or datetime.utcnow()) - origin).total_seconds() * 1000))
+    start_ms = max(0, end_ms - int(duration * 1000)) if duration is not None else None
+    return start_ms, end_ms
+
+
+def append_transcript_segment(session: Session, consultation_id: int, speaker_id: Optional[int], text: str,
+                              spoken_until: Optional[datetime] = None,
+                              duration: Optional[float] = None) -> Optional[TranscriptSegment]:
+    """
+    Persist one transcribed chunk as its own encrypted row.
+
+    Cost does not grow with the length of the consultation: the next sequence
+    number comes from the (consultation_id, sequence) index and nothing that
+    was stored before is read, decrypted or rewritten.
+
+    `spoken_until` is when the chunk's audio ended (defaults to now) and
+    `duration` its length in seconds, if known; they become the segment's
+    start/end offsets within the consultation.
+    """
+    if not text:
+        return None
+
+    text_enc = encrypt_phi(text)
+    start_ms, end_ms = _chunk_offsets(session, consultation_id, spoken_until, duration)
+    for _ in range(3):
+        last = session.exec(
+            select(func.max(TranscriptSegment.sequence)).where(TranscriptSegment.consultation_id == consultation_id)
+        ).first()
+        segment = TranscriptSegment(
+            consultation_id=consultation_id,
+            speaker_id=speaker_id,
+            sequence=(last or 0) + 1,
+            start_ms=start_ms,
+            end_ms=end_ms,
+            text_enc=text_enc
+        )
+        session.add(segment)
+        try:
+            session.commit()
+            return segment
+        except IntegrityError:
+            # Another worker took this sequence number first
+            session.rollback()
+    print(f"[Transcript Error] Could not append segment to consultation #{consultation_id}")
+    return None
+
+
+class LazyTranscript:
+    """
+    Full transcript of a consultation, assembled from its segments only when
+    a view actually reads it. Falls back to the legacy `transcript_enc` blob.
+    """
+
+    def __init__(self, session: Session, consultation_id: int, legacy_enc: Optional[str] = None,
+                 speakers: Optional[Dict[int, str]] = None):
+        self.session = session
+        self.consultation_id = consultation_id
+        self.legacy_enc = legacy_enc
+        self.speakers = speakers or {}
+        self._text = None
+        self._has_segments = None
+
+    def _segments(self):
+        return self.session.exec(
+            select(TranscriptSegment)
+            .where(TranscriptSegment.consultation_id == self.consultation_id)
+            .order_by(TranscriptSegment.sequence)
+            .execution_options(yield_per=100)
+        )
+
+    def _lines(self):
+        legacy = decrypt_phi(self.legacy_enc) if self.legacy_enc else ""
+        if legacy:
+            yield legacy
+        result = self._segments()
+        try:
+            for segment in result:
+                text = decrypt_phi(segment.text_enc)
+                if not text:
+                    continue
+                speaker = self.speakers.get(segment.speaker_id)
+                yield f"{speaker}: {text}" if speaker else text
+        finally:
+            result.close()
+
+    def preview(self, limit: int) -> Tuple[str, bool]:
+        """Return the first `limit` characters and whether more text follows, decrypting only what is needed."""
+        if self._text is not None:
+            return self._text[:limit], len(self._text) > limit
+        parts, size = [], 0
+        for line in self._lines():
+            parts.append(line)
+            size += len(line) + 1
+            if size > limit:
+                break
+        text = "\n".join(parts)
+        return text[:limit], len(text) > limit
+
+    def __str__(self) -> str:
+        if self._text is None:
+            self._text = "\n".join(self._lines())
+        return self._text
+
+    def __bool__(self) -> bool:
+        if self._text is not None:
+            return bool(self._text)
+        if self.legacy_enc and decrypt_phi(self.legacy_enc):
+            return True
+        if self._has_segments is None:
+            self._has_segments = self.session.exec(
+                select(TranscriptSegment.id).where(TranscriptSegment.consultation_id == self.consultation_id).limit(1)
+            ).first() is not None
+        return self._has_segments
+
+    def __len__(self) -> int:
+        return len(str(self))
+
+    def __getitem__(self, key):
+        return str(self)[key]
@@ -0,0 +1,318 @@
+"""
+Latency/throughput benchmark for the transcription path.
+
+Drives POST /consultation/transcribe concurrently for N rooms with synthetic
+audio chunks and reports p50/p95/p99 latency, real-time factor and chunks/sec.
+Runs against a deterministic stub model (default) or the real Faster Whisper
+model when it is installed.
+
+    python -m benchmarks.transcription_bench --rooms 30 --chunks 10 --stub-latency 0.15
+    python -m benchmarks.transcription_bench --model real --rooms 8 --json
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import random
+import sys
+import time
+import wave
+from array import array
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import httpx
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from app import transcription
+from app.database import get_db
+from app.main import app
+from app.routers import workflow
+from app.config import settings
+from app.models import User, UserRole, Consultation, ConsultationStatus
+from app.transcription import ModelPool, TranscriptionExecutor, TranscriptionScheduler, ChunkCache, VoiceActivityGate
+
+SAMPLE_RATE = 16000
+
+
+# -------------------------------
+# Synthetic audio
+# -------------------------------
+def synthetic_chunk(seconds: float, seed: int, silent: bool = False) -> bytes:
+    """A 16 kHz mono WAV chunk: voiced-like harmonics with syllable-rate modulation, or silence."""
+    rng = random.Random(seed)
+    samples = int(SAMPLE_RATE * seconds)
+    pcm = array("h", bytes(2 * samples))
+    if silent:
+        # Faint room noise, far below the VAD threshold, so silent chunks are not byte-identical
+        for i in range(samples):
+            pcm[i] = int(rng.gauss(0, 3))
+    else:
+        pitch = rng.uniform(100, 220)
+        for i in range(samples):
+            t = i / SAMPLE_RATE
+            envelope = 0.5 + 0.5 * math.sin(2 * math.pi * 4 * t)
+            voice = sum(math.sin(2 * math.pi * pitch * h * t) / h for h in (1, 2, 3))
+            pcm[i] = int(6000 * envelope * voice + rng.gauss(0, 200))
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+# -------------------------------
+# Stub model
+# -------------------------------
+class StubSegment:
+    def __init__(self, text: str):
+        self.text = text
+        self.avg_logprob = -0.1
+
+
+class StubWhisperModel:
+    """Deterministic stand-in for WhisperModel with a fixed per-call latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    def transcribe(self, source, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)  # Like CTranslate2, sleeping releases the GIL
+        return iter([StubSegment(f"stub transcript {self.calls}")]), None
+
+
+@contextmanager
+def stub_model(latency: float, instances: int):
+    """Serve transcription from stub models for the duration of the block."""
+    pool = ModelPool([StubWhisperModel(latency) for _ in range(instances)], threads=1)
+
+    @contextmanager
+    def acquire_stub():
+        with pool.acquire() as model:
+            yield model
+
+    original = transcription.acquire_model
+    transcription.acquire_model = acquire_stub
+    try:
+        yield pool
+    finally:
+        transcription.acquire_model = original
+
+
+def decode_wav(data: bytes):
+    """Decode a synthetic WAV chunk to float32 PCM without faster-whisper."""
+    with wave.open(io.BytesIO(data), "rb") as wav:
+        frames = wav.readframes(wav.getnframes())
+    return transcription.np.frombuffer(frames, dtype=transcription.np.int16).astype(transcription.np.float32) / 32768.0
+
+
+@contextmanager
+def stub_voice_gate(required: bool = True):
+    """
+    Run the energy VAD gate on the synthetic chunks in stub mode. The real
+    prepare_chunk needs faster-whisper to decode, so without this the gate
+    would pass every chunk through and silence would never be measured.
+    """
+    if transcription.np is None:
+        if required:
+            raise RuntimeError("numpy is required to measure the VAD gate (--silence-ratio) in stub mode")
+        yield None
+        return
+    gate = VoiceActivityGate(
+        mode="energy",
+        threshold_db=settings.TRANSCRIBE_VAD_THRESHOLD_DB,
+        min_speech_ms=settings.TRANSCRIBE_VAD_MIN_SPEECH_MS
+    )
+
+    def prepare_stub_chunk(audio):
+        pcm = decode_wav(audio)
+        return pcm, gate.has_speech(pcm)
+
+    originals = (workflow.prepare_chunk, workflow.voice_gate)
+    workflow.prepare_chunk, workflow.voice_gate = prepare_stub_chunk, gate
+    try:
+        yield gate
+    finally:
+        workflow.prepare_chunk, workflow.voice_gate = originals
+
+
+def seed_rooms(engine, rooms: int):
+    """Active consultations 1..rooms, each with patient N speaking (only participants are transcribed)."""
+    with Session(engine) as session:
+        doctor = User(id=rooms + 1, email="bench-doctor@example.com", hashed_password="x",
+                      full_name="Bench Doctor", role=UserRole.DOCTOR)
+        session.add(doctor)
+        for room in range(1, rooms + 1):
+            session.add(User(id=room, email=f"bench-{room}@example.com", hashed_password="x",
+                             full_name=f"Bench Patient {room}", role=UserRole.PATIENT))
+            session.add(Consultation(id=room, patient_id=room, doctor_id=doctor.id, specialty="General",
+                                     status=ConsultationStatus.ACTIVE, symptoms_enc=""))
+        session.commit()
+
+
+@contextmanager
+def isolated_pipeline(workers: int, max_queue: int, batch_size: int, batch_wait_ms: float, timeout: float,
+                      rooms: int = 0):
+    """Fresh executor, scheduler, cache and in-memory DB so runs do not interfere."""
+    engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    seed_rooms(engine, rooms)
+
+    def get_bench_db():
+        with Session(engine) as session:
+            yield session
+
+    executor = TranscriptionExecutor(mode="thread", max_workers=workers, max_queue=max_queue, timeout=timeout)
+    scheduler = TranscriptionScheduler(executor, max_batch_size=batch_size, max_wait_ms=batch_wait_ms, max_pending=max_queue)
+    originals = (workflow.transcription_scheduler, workflow.chunk_cache)
+    workflow.transcription_scheduler = scheduler
+    workflow.chunk_cache = ChunkCache()
+    app.dependency_overrides[get_db] = get_bench_db
+    try:
+        yield scheduler
+    finally:
+        scheduler.shutdown()
+        executor.shutdown(wait=False)
+        workflow.transcription_scheduler, workflow.chunk_cache = originals
+        app.dependency_overrides.pop(get_db, None)
+
+
+# -------------------------------
+# Load generator
+# -------------------------------
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _drive_room(client, room: int, chunks: list, pace: float, results: list):
+    for data in chunks:
+        started = time.perf_counter()
+        response = await client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": str(room), "user_id": str(room)},
+            files={"audio_blob": ("chunk.wav", data, "audio/wav")}
+        )
+        latency = time.perf_counter() - started
+        body = response.json() if response.status_code == 200 else {}
+        results.append((response.status_code, latency, bool(body.get("skipped"))))
+        if pace:
+            await asyncio.sleep(max(0.0, pace - latency))
+
+
+async def _run(rooms: int, chunks_per_room: int, chunk_seconds: float, silence_ratio: float, realtime: bool) -> dict:
+    rng = random.Random(42)
+    room_chunks = {
+        room: [
+            synthetic_chunk(chunk_seconds, seed=room * 10000 + i, silent=rng.random() < silence_ratio)
+            for i in range(chunks_per_room)
+        ]
+        for room in range(1, rooms + 1)
+    }
+
+    results = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            _drive_room(client, room, chunks, chunk_seconds if realtime else 0, results)
+            for room, chunks in room_chunks.items()
+        ])
+        elapsed = time.perf_counter() - started
+
+    latencies = [latency for status, latency, _ in results if status == 200]
+    total = len(results)
+    return {
+        "requests": total,
+        "ok": len(latencies),
+        "rejected_429": sum(1 for status, _, _ in results if status == 429),
+        "timeouts_504": sum(1 for status, _, _ in results if status == 504),
+        "vad_skipped": sum(1 for _, _, skipped in results if skipped),
+        "elapsed_s": round(elapsed, 3),
+        "chunks_per_sec": round(total / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(max(latencies, default=0) * 1000, 1)
+        },
+        # Seconds of processing per second of audio, per chunk and for the whole run
+        "rtf_per_chunk": round((sum(latencies) / len(latencies)) / chunk_seconds, 3) if latencies else 0.0,
+        "rtf_aggregate": round(elapsed / (total * chunk_seconds), 3) if total else 0.0
+    }
+
+
+def run_benchmark(rooms: int = 8, chunks: int = 5, chunk_seconds: float = 3.0, model: str = "stub",
+                  stub_latency: float = 0.1, workers: int = 1, max_queue: int = 64, batch_size: int = 8,
+                  batch_wait_ms: float = 40, timeout: float = 60, silence_ratio: float = 0.0,
+                  realtime: bool = False) -> dict:
+    """Run one benchmark configuration and return its report."""
+    if model == "real" and transcription.get_model_pool() is None:
+        raise RuntimeError("faster-whisper is not installed; use --model stub")
+
+    with isolated_pipeline(workers, max_queue, batch_size, batch_wait_ms, timeout, rooms=rooms):
+        if model == "stub":
+            with stub_model(stub_latency, workers), stub_voice_gate(required=silence_ratio > 0):
+                report = asyncio.run(_run(rooms, chunks, chunk_seconds, silence_ratio, realtime))
+        else:
+            report = asyncio.run(_run(rooms, chunks, chunk_seconds, silence_ratio, realtime))
+
+    report["config"] = {
+        "model": model, "rooms": rooms, "chunks_per_room": chunks, "chunk_seconds": chunk_seconds,
+        "stub_latency_s": stub_latency if model == "stub" else None, "workers": workers,
+        "batch_size": batch_size, "batch_wait_ms": batch_wait_ms, "silence_ratio": silence_ratio,
+        "realtime": realtime
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /consultation/transcribe path")
+    parser.add_argument("--model", choices=["stub", "real"], default="stub")
+    parser.add_argument("--rooms", type=int, default=8, help="Concurrent consultations")
+    parser.add_argument("--chunks", type=int, default=5, help="Chunks sent per room")
+    parser.add_argument("--chunk-seconds", type=float, default=3.0)
+    parser.add_argument("--stub-latency", type=float, default=0.1, help="Seconds per stub decode call")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--batch-wait-ms", type=float, default=40)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--silence-ratio", type=float, default=0.0, help="Fraction of chunks that are silent")
+    parser.add_argument("--realtime", action="store_true", help="Pace each room at one chunk per chunk duration")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        rooms=args.rooms, chunks=args.chunks, chunk_seconds=args.chunk_seconds, model=args.model,
+        stub_latency=args.stub_latency, workers=args.workers, max_queue=args.max_queue,
+        batch_size=args.batch_size, batch_wait_ms=args.batch_wait_ms, timeout=args.timeout,
+        silence_ratio=args.silence_ratio, realtime=args.realtime
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    latency = report["latency_ms"]
+    print(f"model={args.model} rooms={args.rooms} chunks/room={args.chunks} workers={args.workers} "
+          f"batch={args.batch_size}/{args.batch_wait_ms}ms")
+    print(f"requests={report['requests']} ok={report['ok']} 429={report['rejected_429']} "
+          f"504={report['timeouts_504']} vad_skipped={report['vad_skipped']}")
+    print(f"latency p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms max={latency['max']}ms")
+    print(f"chunks/sec={report['chunks_per_sec']} rtf/chunk={report['rtf_per_chunk']} "
+          f"rtf/aggregate={report['rtf_aggregate']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+Test cases for consultation room WebSocket fan-out
+"""
+import asyncio
+import tempfile
+import pytest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.connections import ConnectionManager, SLOW_CONSUMER_CLOSE_CODE
+from app.broker import BrokerHub, UnixSocketBroker
+from app import codec
+from app.codec import Frame, MSGPACK_SUBPROTOCOL
+
+
+class FakeSocket:
+    """Records what it is sent; a stalled socket blocks every send until released."""
+
+    def __init__(self, stalled: bool = False, broken: bool = False, subprotocols=()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.accepted_subprotocol = None
+        self.sent = []
+        self.closed_with = None
+        self.broken = broken
+        self.release = asyncio.Event()
+        if not stalled:
+            self.release.set()
+
+    async def accept(self, subprotocol=None):
+        self.accepted_subprotocol = subprotocol
+
+    async def send_text(self, message: str):
+        await self.release.wait()
+        if self.broken:
+            raise RuntimeError("socket is gone")
+        self.sent.append(message)
+
+    async def send_bytes(self, data: bytes):
+        await self.send_text(data)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def close_all(manager: ConnectionManager):
+    for room_id, room in list(manager.active_connections.items()):
+        for websocket in list(room):
+            manager.disconnect(websocket, room_id)
+
+
+class TestConnectionManager:
+    """Test per-connection send queues and overflow policy"""
+
+    async def test_slow_peer_does_not_delay_the_room(self):
+        """Test a stalled socket leaves other peers' delivery untouched"""
+        manager = ConnectionManager(max_queue=8, send_timeout=5)
+        slow, fast = FakeSocket(stalled=True), FakeSocket()
+        await manager.connect(slow, 1)
+        await manager.connect(fast, 1)
+
+        await asyncio.wait_for(manager.broadcast("offer", 1), 0.1)
+        await settle()
+        assert fast.sent == ["offer"]
+        assert slow.sent == []
+
+        slow.release.set()
+        await settle()
+        assert slow.sent == ["offer"]
+        close_all(manager)
+
+    async def test_stale_candidates_are_shed_first(self):
+        """Test a full queue drops the oldest droppable message, never chat"""
+        manager = ConnectionManager(max_queue=2, send_timeout=5)
+        slow = FakeSocket(stalled=True)
+        await manager.connect(slow, 1)
+        await settle()  # The writer is idle until the first enqueue
+
+        await manager.broadcast("first", 1)
+        await manager.broadcast("cand-1", 1, kind="candidate")
+        await manager.broadcast("chat", 1, kind="chat")
+        await manager.broadcast("cand-2", 1, kind="candidate")
+        assert manager.stats()["dropped"] == 2
+
+        slow.release.set()
+        await settle()
+        assert slow.sent == ["first", "chat"]
+        assert slow.closed_with is None
+        close_all(manager)
+
+    async def test_burst_does_not_shed_a_healthy_peer(self):
+        """Test filling the queue before the writer had a turn is not a slow consumer"""
+        manager = ConnectionManager(max_queue=1, send_timeout=5, stall_after=5)
+        fast = FakeSocket()
+        await manager.connect(fast, 1)
+        for i in range(2):
+            await manager.broadcast(f"chat-{i}", 1, kind="chat")
+        await settle()
+        assert fast.sent == ["chat-0", "chat-1"]
+        assert fast.closed_with is None
+        close_all(manager)
+
+    async def test_undroppable_overflow_disconnects_a_stalled_peer(self):
+        """Test a peer stuck on a send is disconnected instead of silently losing chat"""
+        manager = ConnectionManager(max_queue=1, send_timeout=5, stall_after=0.01)
+        slow, fast = FakeSocket(stalled=True), FakeSocket()
+        await manager.connect(slow, 1)
+        await manager.connect(fast, 1)
+
+        await manager.broadcast("chat-0", 1, kind="chat")
+        await asyncio.sleep(0.02)  # slow's writer is now stuck on chat-0
+        for i in (1, 2):
+            await manager.broadcast(f"chat-{i}", 1, kind="chat")
+        await settle()
+        assert slow.closed_with == SLOW_CONSUMER_CLOSE_CODE
+        assert fast.sent == ["chat-0", "chat-1", "chat-2"]
+        close_all(manager)
+
+    async def test_failed_send_does_not_abort_the_broadcast(self):
+        """Test a dead socket is dropped while the others keep receiving"""
+        manager = ConnectionManager(max_queue=8, send_timeout=5)
+        dead, alive = FakeSocket(broken=True), FakeSocket()
+        await manager.connect(dead, 1)
+        await manager.connect(alive, 1)
+
+        await manager.broadcast("one", 1)
+        await settle()
+        await manager.broadcast("two", 1)
+        await settle()
+        assert alive.sent == ["one", "two"]
+        close_all(manager)
+
+    async def test_send_timeout_sheds_a_hung_socket(self):
+        """Test a send that never completes frees the writer after the timeout"""
+        manager = ConnectionManager(max_queue=8, send_timeout=0.01)
+        hung = FakeSocket(stalled=True)
+        await manager.connect(hung, 1)
+        await manager.broadcast("lost", 1)
+        await asyncio.sleep(0.05)
+        connection = manager.active_connections[1][hung]
+        assert connection.closed
+        assert connection.enqueue("later") is False
+        close_all(manager)
+
+    async def test_closed_writer_finishes(self):
+        """Test closing a connection ends its writer even mid-send"""
+        manager = ConnectionManager(max_queue=8, send_timeout=5)
+        hung = FakeSocket(stalled=True)
+        await manager.connect(hung, 1)
+        connection = manager.active_connections[1][hung]
+        await manager.broadcast("pending", 1)
+        await settle()
+        manager.disconnect(hung, 1)
+        hung.release.set()
+        await asyncio.wait_for(asyncio.gather(connection._writer, return_exceptions=True), 1)
+        assert connection._writer.done()
+
+    async def test_broadcast_except_skips_the_sender(self):
+        """Test signaling is not echoed back"""
+        manager = ConnectionManager(max_queue=8, send_timeout=5)
+        sender, peer = FakeSocket(), FakeSocket()
+        await manager.connect(sender, 1)
+        await manager.connect(peer, 1)
+        await manager.broadcast_except("answer", 1, sender)
+        await settle()
+        assert sender.sent == [] and peer.sent == ["answer"]
+        manager.disconnect(sender, 1)
+        manager.disconnect(peer, 1)
+        assert manager.stats()["connections"] == 0
+
+
+@pytest.fixture(name="socket_path")
+def socket_path_fixture():
+    # Unix socket paths are length-limited, so keep it short
+    directory = tempfile.mkdtemp(prefix="cv")
+    yield os.path.join(directory, "b.sock")
+    for name in os.listdir(directory):
+        os.unlink(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+async def eventually(condition, timeout: float = 1.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not met in time"
+        await asyncio.sleep(0.01)
+
+
+class TestBroker:
+    """Test room broadcasts across workers"""
+
+    async def test_hub_links_rooms_across_workers(self, socket_path):
+        """Test a broadcast on one worker reaches the room's sockets on another"""
+        hub = BrokerHub(socket_path)
+        await hub.start()
+        worker_a, worker_b = ConnectionManager(max_queue=8), ConnectionManager(max_queue=8)
+        for worker in (worker_a, worker_b):
+            await worker.use_broker(UnixSocketBroker(socket_path, reconnect_delay=0.01))
+            await worker.broker.wait_connected(1)
+        await eventually(lambda: len(hub._workers) == 2)
+        doctor, patient, other_room = FakeSocket(), FakeSocket(), FakeSocket()
+        await worker_a.connect(doctor, 1)
+        await worker_b.connect(patient, 1)
+        await worker_b.connect(other_room, 2)
+
+        await worker_a.broadcast_except("offer", 1, doctor, kind="offer")
+        await worker_b.broadcast("transcript", 1)
+        # Local delivery is immediate; relayed frames follow, so only membership is checked
+        await eventually(lambda: sorted(patient.sent) == ["offer", "transcript"] and doctor.sent == ["transcript"])
+        assert other_room.sent == []
+        assert worker_a.stats()["broker"]["relayed"] == 1
+
+        for worker in (worker_a, worker_b):
+            close_all(worker)
+            await worker.broker.close()
+        await hub.close()
+
+    async def test_local_delivery_without_the_hub(self, socket_path):
+        """Test a worker keeps serving its own sockets while the hub is down"""
+        worker = ConnectionManager(max_queue=8)
+        await worker.use_broker(UnixSocketBroker(socket_path, reconnect_delay=0.01))
+        peer = FakeSocket()
+        await worker.connect(peer, 1)
+        await worker.broadcast("chat", 1)
+        await settle()
+        assert peer.sent == ["chat"]
+        assert worker.stats()["broker"]["unrelayed"] == 1
+
+        # The hub coming up later is picked up without a restart
+        hub = BrokerHub(socket_path)
+        await hub.start()
+        await worker.broker.wait_connected(1)
+        close_all(worker)
+        await worker.broker.close()
+        await hub.close()
+
+    async def test_in_memory_broker_is_the_default(self):
+        """Test a single worker needs no hub"""
+        worker = ConnectionManager(max_queue=8)
+        peer = FakeSocket()
+        await worker.connect(peer, 3)
+        await worker.broadcast("hello", 3)
+        await settle()
+        assert peer.sent == ["hello"]
+        assert worker.stats()["broker"] == {"type": "InMemoryBroker"}
+        close_all(worker)
+
+
+class TestFrameEncoding:
+    """Test serialize-once broadcast and the MessagePack subprotocol"""
+
+    async def test_broadcast_is_encoded_once(self, monkeypatch):
+        """Test one serialization is shared by every recipient"""
+        encodes = []
+        real_dumps = codec.dumps
+        monkeypatch.setattr(codec, "dumps", lambda obj: encodes.append(obj) or real_dumps(obj))
+        manager = ConnectionManager(max_queue=8)
+        peers = [FakeSocket() for _ in range(3)]
+        for peer in peers:
+            await manager.connect(peer, 1)
+        await manager.broadcast({"type": "chat", "text": "hi"}, 1)
+        await settle()
+        assert len(encodes) == 1
+        assert {peer.sent[0] for peer in peers} == {codec.dumps({"type": "chat", "text": "hi"})}
+        close_all(manager)
+
+    def test_received_text_is_forwarded_verbatim(self, monkeypatch):
+        """Test signaling frames keep the client's own encoding"""
+        monkeypatch.setattr(codec, "dumps", lambda obj: pytest.fail("re-encoded"))
+        text = '{"type": "candidate", "candidate": "a=1"}'
+        assert Frame({"type": "candidate"}, text).text is text
+
+    async def test_json_clients_ignore_unknown_subprotocols(self):
+        """Test a socket without the MessagePack offer is accepted as JSON"""
+        manager = ConnectionManager(max_queue=8)
+        peer = FakeSocket(subprotocols=["something-else"])
+        await manager.connect(peer, 1)
+        assert peer.accepted_subprotocol is None
+        await manager.broadcast({"type": "chat"}, 1)
+        await settle()
+        assert codec.loads(peer.sent[0]) == {"type": "chat"}
+        close_all(manager)
+
+    async def test_msgpack_clients_get_binary_frames(self):
+        """Test a client that negotiated MessagePack receives packed frames"""
+        msgpack = pytest.importorskip("msgpack")
+        manager = ConnectionManager(max_queue=8)
+        packed, plain = FakeSocket(subprotocols=[MSGPACK_SUBPROTOCOL]), FakeSocket()
+        await manager.connect(packed, 1)
+        await manager.connect(plain, 1)
+        assert packed.accepted_subprotocol == MSGPACK_SUBPROTOCOL
+        await manager.broadcast('{"type":"chat","text":"hi"}', 1)
+        await settle()
+        assert msgpack.unpackb(packed.sent[0]) == {"type": "chat", "text": "hi"}
+        assert plain.sent == ['{"type":"chat","text":"hi"}']
+        close_all(manager)
+
+    def test_non_object_json_is_wrapped_as_chat(self):
+        """Test a bare JSON value from a client is relayed as chat text instead of failing the socket"""
+        from fastapi.testclient import TestClient
+        from app.main import app
+        with TestClient(app).websocket_connect("/ws/41/2") as ws:
+            ws.send_text("5")
+            message = ws.receive_json()
+        assert (message["type"], message["text"], message["user_id"]) == ("chat", "5", 2)
+
+
+class TestCandidateCoalescing:
+    """Test trickle-ICE candidate batching and passthrough"""
+
+    async def test_burst_arrives_as_one_frame(self):
+        """Test candidates within the window reach an opted-in peer as one candidates frame"""
+        manager = ConnectionManager(max_queue=64, coalesce_ms=10)
+        sender, peer = FakeSocket(), FakeSocket()
+        await manager.connect(sender, 1)
+        await manager.connect(peer, 1, batch_candidates=True)
+        for i in range(5):
+            await manager.relay_candidate(Frame({"type": "candidate", "candidate": f"c{i}"}), 1, sender)
+        await settle()
+        assert peer.sent == []
+        await eventually(lambda: len(peer.sent) == 1)
+        batch = codec.loads(peer.sent[0])
+        assert batch["type"] == "candidates"
+        assert [c["candidate"] for c in batch["candidates"]] == [f"c{i}" for i in range(5)]
+        assert sender.sent == []
+        close_all(manager)
+
+    async def test_passthrough_peers_get_each_candidate(self):
+        """Test a client that did not opt in keeps receiving single candidate frames"""
+        manager = ConnectionManager(max_queue=64, coalesce_ms=10)
+        sender, legacy, batching = FakeSocket(), FakeSocket(), FakeSocket()
+        await manager.connect(sender, 1)
+        await manager.connect(legacy, 1)
+        await manager.connect(batching, 1, batch_candidates=True)
+        for i in range(3):
+            await manager.relay_candidate(Frame(text=f'{{"type":"candidate","candidate":"c{i}"}}'), 1, sender)
+        await eventually(lambda: len(batching.sent) == 1)
+        assert [codec.loads(m)["candidate"] for m in legacy.sent] == ["c0", "c1", "c2"]
+        close_all(manager)
+
+    async def test_offer_flushes_pending_candidates_first(self):
+        """Test a sender's batched candidates are not reordered behind its next description"""
+        manager = ConnectionManager(max_queue=64, coalesce_ms=1000)
+        sender, peer = FakeSocket(), FakeSocket()
+        await manager.connect(sender, 1)
+        await manager.connect(peer, 1, batch_candidates=True)
+        await manager.relay_candidate(Frame({"type": "candidate", "candidate": "c0"}), 1, sender)
+        await manager.flush_candidates(sender)
+        await manager.broadcast_except({"type": "offer"}, 1, sender, kind="offer")
+        await settle()
+        assert [codec.loads(m)["type"] for m in peer.sent] == ["candidates", "offer"]
+        close_all(manager)
+
+    async def test_window_zero_disables_batching(self):
+        """Test opted-in clients fall back to passthrough when coalescing is off"""
+        manager = ConnectionManager(max_queue=64, coalesce_ms=0)
+        sender, peer = FakeSocket(), FakeSocket()
+        await manager.connect(sender, 1)
+        await manager.connect(peer, 1, batch_candidates=True)
+        await manager.relay_candidate(Frame(text='{"type":"candidate"}'), 1, sender)
+        await settle()
+        assert peer.sent == ['{"type":"candidate"}']
+        assert manager._pending_candidates == {}
+        close_all(manager)
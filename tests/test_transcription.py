@@ -0,0 +1,1278 @@
+"""
+Test cases for the transcription pipeline (executor, batching, transcript store, endpoint)
+"""
+import asyncio
+import tempfile
+import threading
+from contextlib import nullcontext
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from app.main import app
+from app.database import get_db
+from app.config import settings
+from app.models import User, Consultation, UserRole, ConsultationStatus, TranscriptSegment
+from app.security import encrypt_phi, decrypt_phi
+from app.transcripts import append_transcript_segment, LazyTranscript
+from app.routers import workflow
+from app.routers import admin as admin_router
+from app import transcription
+from app.transcription import (
+    TranscriptionExecutor, TranscriptionScheduler, TranscriptionBusy, TranscriptionTimeout,
+    TranscriptionDropped, TranscriptionServiceUnavailable, QualityController,
+    ChunkCache, VoiceActivityGate, AudioStream, open_audio_source, transcribe_audio_chunk, transcribe_batch
+)
+from app.stream_decoder import WebmDemuxer, PcmRingBuffer, StreamDecoder
+from app.transcription_service import TranscriptionService, TranscriptionServiceClient, encode_chunks, decode_chunks
+from app.security import create_access_token
+
+
+@pytest.fixture(name="session")
+def session_fixture():
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session):
+    def get_session_override():
+        return session
+
+    app.dependency_overrides[get_db] = get_session_override
+    client = TestClient(app=app, follow_redirects=False)
+    yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture(autouse=True)
+def fresh_chunk_cache(monkeypatch):
+    monkeypatch.setattr(workflow, "chunk_cache", ChunkCache())
+
+
+class TestTranscriptionExecutor:
+    """Test the bounded transcription worker pool"""
+
+    async def test_run_returns_result(self):
+        """Test that work runs off the event loop and returns its result"""
+        executor = TranscriptionExecutor(max_workers=1, max_queue=1, timeout=5)
+        caller = threading.get_ident()
+        worker = await executor.run(threading.get_ident)
+        assert worker != caller
+        assert executor.pending == 0
+        executor.shutdown()
+
+    async def test_rejects_when_saturated(self):
+        """Test that calls beyond workers + queue are rejected with retry hint"""
+        executor = TranscriptionExecutor(max_workers=1, max_queue=0, timeout=5, retry_after=3)
+        gate = threading.Event()
+        first = asyncio.ensure_future(executor.run(gate.wait, 5))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(TranscriptionBusy) as exc_info:
+            await executor.run(time.sleep, 0)
+        assert exc_info.value.retry_after == 3
+
+        gate.set()
+        assert await first is True
+        executor.shutdown()
+
+    async def test_timeout_keeps_slot_until_work_finishes(self):
+        """Test that a timed-out call still holds its slot while running"""
+        executor = TranscriptionExecutor(max_workers=1, max_queue=0, timeout=0.05)
+        gate = threading.Event()
+        with pytest.raises(TranscriptionTimeout):
+            await executor.run(gate.wait, 5)
+        assert executor.pending == 1
+
+        gate.set()
+        await asyncio.sleep(0.05)
+        assert executor.pending == 0
+        executor.shutdown()
+
+
+class FakeSegment:
+    def __init__(self, text, avg_logprob=-0.2):
+        self.text = text
+        self.avg_logprob = avg_logprob
+
+
+class FakeWhisperModel:
+    """Records what the decoder was handed and returns canned segments"""
+
+    def __init__(self, texts=("Hello doctor",)):
+        self.texts = texts
+        self.sources = []
+
+    def transcribe(self, source, **kwargs):
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                self.sources.append(("path", f.read()))
+        else:
+            self.sources.append(("stream", source.read()))
+        return iter([FakeSegment(t) for t in self.texts]), None
+
+
+class TestInMemoryAudio:
+    """Test that chunks are decoded without temp files in the working directory"""
+
+    def test_bytes_are_decoded_from_memory(self, monkeypatch, tmp_path):
+        """Test the default memory spool hands the decoder a buffer"""
+        model = FakeWhisperModel()
+        monkeypatch.setattr(transcription, "acquire_model", lambda: nullcontext(model))
+        monkeypatch.chdir(tmp_path)
+
+        text = transcribe_audio_chunk(b"webm-bytes")
+        assert text == "Hello doctor"
+        assert model.sources == [("stream", b"webm-bytes")]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_hallucinations_are_filtered(self, monkeypatch):
+        """Test blacklist filtering still applies to in-memory chunks"""
+        model = FakeWhisperModel(texts=("Thank you", "My chest hurts"))
+        monkeypatch.setattr(transcription, "acquire_model", lambda: nullcontext(model))
+        assert transcribe_audio_chunk(b"webm-bytes") == "My chest hurts"
+
+    def test_memfd_spool_provides_a_path(self, monkeypatch):
+        """Test the memfd spool for decoders that need a file path"""
+        if not hasattr(os, "memfd_create"):
+            pytest.skip("memfd_create not available on this platform")
+        monkeypatch.setattr(settings, "TRANSCRIBE_SPOOL", "memfd")
+        with open_audio_source(b"webm-bytes") as source:
+            assert source.startswith("/proc/self/fd/")
+            with open(source, "rb") as f:
+                assert f.read() == b"webm-bytes"
+
+    def test_empty_chunk_is_skipped(self, monkeypatch):
+        """Test empty uploads never reach the model"""
+        model = FakeWhisperModel()
+        monkeypatch.setattr(transcription, "acquire_model", lambda: nullcontext(model))
+        assert transcribe_audio_chunk(b"") == ""
+        assert model.sources == []
+
+
+class TimedFakeModel(FakeWhisperModel):
+    """Fake model with a fixed decode latency, used for calibration"""
+
+    def __init__(self, threads, latency=0.02):
+        super().__init__()
+        self.threads = threads
+        self.latency = latency
+        self.calls = 0
+
+    def transcribe(self, source, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return iter([]), None
+
+
+class TestModelPool:
+    """Test model pool loading, warm-up and calibration"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_pool(self, monkeypatch):
+        pytest.importorskip("numpy")
+        monkeypatch.setattr(transcription, "WHISPER_AVAILABLE", True)
+        monkeypatch.setattr(transcription, "_model_pool", None)
+        monkeypatch.setattr(transcription, "_thread_budget", lambda: 4)
+        monkeypatch.setattr(transcription, "_load_model", lambda threads: TimedFakeModel(threads))
+
+    def test_pool_uses_configured_split(self, monkeypatch):
+        """Test instance and thread counts come from Settings"""
+        monkeypatch.setattr(settings, "WHISPER_INSTANCES", 2)
+        monkeypatch.setattr(settings, "WHISPER_THREADS", 0)
+        pool = transcription.get_model_pool()
+        assert pool.instances == 2
+        assert [m.threads for m in pool.models] == [2, 2]
+
+    def test_acquire_hands_out_each_instance_exclusively(self, monkeypatch):
+        """Test concurrent callers never share an instance"""
+        monkeypatch.setattr(settings, "WHISPER_INSTANCES", 2)
+        with transcription.acquire_model() as first, transcription.acquire_model() as second:
+            assert first is not second
+
+    def test_calibration_picks_best_throughput(self, monkeypatch):
+        """Test autotune keeps the split with the best throughput and warms it"""
+        monkeypatch.setattr(settings, "WHISPER_INSTANCES", 0)
+        monkeypatch.setattr(settings, "WHISPER_THREADS", 0)
+        monkeypatch.setattr(settings, "TRANSCRIBE_WORKERS", 0)
+        executor = TranscriptionExecutor(max_workers=1)
+        monkeypatch.setattr(transcription, "transcription_executor", executor)
+
+        transcription.preload_models()
+        pool = transcription.get_model_pool()
+        # Fixed-latency fake: more parallel instances always win
+        assert (pool.instances, pool.threads) == (4, 1)
+        assert all(m.calls > 0 for m in pool.models)
+        assert executor.max_workers == 4
+
+    def test_failed_light_model_is_not_reloaded(self, monkeypatch):
+        """Test a light model that fails to load falls back once, not on every batch"""
+        attempts = []
+
+        def load(threads, model_name=None):
+            if model_name:
+                attempts.append(model_name)
+                raise RuntimeError("no such model")
+            return TimedFakeModel(threads)
+
+        monkeypatch.setattr(transcription, "_load_model", load)
+        monkeypatch.setattr(transcription, "_light_pools", {})
+        main = transcription.get_model_pool()
+        for _ in range(3):
+            assert transcription.get_light_model_pool("tiny") is main
+        assert attempts == ["tiny"]
+
+    def test_process_mode_warms_the_pool_workers(self, monkeypatch):
+        """Test warm-up in process mode runs in the workers, not the parent"""
+        executor = TranscriptionExecutor(mode="process", max_workers=2)
+        monkeypatch.setattr(transcription, "transcription_executor", executor)
+        monkeypatch.setattr(transcription, "preload_models", lambda: pytest.fail("parent loaded the models"))
+
+        transcription.warm_up()
+        assert executor._pool._initializer is transcription.warm_worker_process
+        assert len(executor._pool._processes) == 2
+        executor.shutdown()
+
+    def test_prewarm_keeps_the_initializer_across_resizes(self):
+        """Test a resized pool still warms its new workers"""
+        warmed = []
+        executor = TranscriptionExecutor(max_workers=1)
+        executor.prewarm(lambda: warmed.append(threading.current_thread().name))
+        executor.resize(2)
+        assert executor._get_pool()._initializer is executor.initializer
+        assert warmed
+        executor.shutdown()
+
+
+class TestMicroBatching:
+    """Test cross-consultation batching of chunks"""
+
+    async def test_chunks_from_several_rooms_share_one_batch(self):
+        """Test chunks arriving together are decoded in one call and routed back"""
+        calls = []
+
+        def batch_fn(chunks):
+            calls.append(list(chunks))
+            return [chunk.decode().upper() for chunk in chunks]
+
+        executor = TranscriptionExecutor(max_workers=1, max_queue=4, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_batch_size=4, max_wait_ms=50)
+        results = await asyncio.gather(*[
+            scheduler.submit(room, f"room{room}".encode()) for room in (1, 2, 3)
+        ])
+        assert results == ["ROOM1", "ROOM2", "ROOM3"]
+        assert calls == [[b"room1", b"room2", b"room3"]]
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_batch_size_is_capped(self):
+        """Test no batch exceeds max_batch_size"""
+        sizes = []
+
+        def batch_fn(chunks):
+            sizes.append(len(chunks))
+            return ["" for _ in chunks]
+
+        executor = TranscriptionExecutor(max_workers=1, max_queue=4, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_batch_size=2, max_wait_ms=20, max_pending=8)
+        await asyncio.gather(*[scheduler.submit(room, b"x") for room in range(5)])
+        assert max(sizes) <= 2
+        assert sum(sizes) == 5
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_rejects_when_too_many_chunks_are_waiting(self):
+        """Test backpressure at the scheduler queue"""
+        gate = threading.Event()
+
+        def batch_fn(chunks):
+            gate.wait(5)
+            return ["" for _ in chunks]
+
+        executor = TranscriptionExecutor(max_workers=1, max_queue=0, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_batch_size=1, max_wait_ms=0, max_pending=1)
+        first = asyncio.ensure_future(scheduler.submit(1, b"a"))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(scheduler.submit(2, b"b"))
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(TranscriptionBusy):
+            await scheduler.submit(3, b"c")
+
+        gate.set()
+        await asyncio.gather(first, second)
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_busy_room_does_not_starve_quiet_room(self):
+        """Test batches are filled round-robin across consultations"""
+        calls = []
+
+        def batch_fn(chunks):
+            calls.append(list(chunks))
+            return ["" for _ in chunks]
+
+        executor = TranscriptionExecutor(max_workers=1, max_queue=4, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_batch_size=2, max_wait_ms=50)
+        await asyncio.gather(
+            scheduler.submit(1, b"1a"), scheduler.submit(1, b"1b"), scheduler.submit(1, b"1c"),
+            scheduler.submit(2, b"2a")
+        )
+        assert calls[0] == [b"1a", b"2a"]
+        assert sum(len(c) for c in calls) == 4
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_weighted_room_gets_more_per_turn(self):
+        """Test a room's weight is the number of chunks it gets per turn"""
+        calls = []
+
+        def batch_fn(chunks):
+            calls.append(list(chunks))
+            return ["" for _ in chunks]
+
+        executor = TranscriptionExecutor(max_workers=1, max_queue=4, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_batch_size=3, max_wait_ms=50)
+        scheduler.set_weight(1, 2)
+        await asyncio.gather(
+            scheduler.submit(1, b"1a"), scheduler.submit(1, b"1b"), scheduler.submit(1, b"1c"),
+            scheduler.submit(2, b"2a"), scheduler.submit(2, b"2b")
+        )
+        assert calls[0] == [b"1a", b"1b", b"2a"]
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_room_backlog_drops_oldest_chunk(self):
+        """Test a room over its backlog loses its oldest waiting chunk"""
+        gate = threading.Event()
+
+        def batch_fn(chunks):
+            gate.wait(5)
+            return [chunk.decode() for chunk in chunks]
+
+        executor = TranscriptionExecutor(max_workers=1, max_queue=0, timeout=5)
+        scheduler = TranscriptionScheduler(
+            executor, batch_fn=batch_fn, max_batch_size=1, max_wait_ms=0, max_room_backlog=2
+        )
+        inflight = asyncio.ensure_future(scheduler.submit(1, b"a"))
+        await asyncio.sleep(0.05)
+        stale = asyncio.ensure_future(scheduler.submit(1, b"b"))
+        kept = [asyncio.ensure_future(scheduler.submit(1, chunk)) for chunk in (b"c", b"d")]
+        await asyncio.sleep(0.01)
+        assert scheduler.backlog(1) == 2
+
+        with pytest.raises(TranscriptionDropped):
+            await stale
+        gate.set()
+        assert await inflight == "a"
+        assert await asyncio.gather(*kept) == ["c", "d"]
+        assert scheduler.dropped == 1
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_partials_are_relayed_as_running_text(self):
+        """Test segments decoded on the worker thread reach the listener in order"""
+        def batch_fn(chunks, on_segment=None):
+            for segment in ("Hello", "doctor"):
+                on_segment(0, segment)
+            return ["Hello doctor"]
+
+        partials = []
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_wait_ms=0)
+        assert await scheduler.submit(1, b"a", partials.append) == "Hello doctor"
+        await asyncio.sleep(0)
+        assert partials == ["Hello", "Hello doctor"]
+        scheduler.shutdown()
+        executor.shutdown()
+
+    def test_transcribe_chunk_reports_segments(self, monkeypatch):
+        """Test each kept segment is reported as the decoder yields it"""
+        model = FakeWhisperModel()
+        monkeypatch.setattr(transcription, "acquire_model", lambda: nullcontext(model))
+        segments = []
+        assert transcribe_batch([b"a"], lambda index, text: segments.append((index, text))) == ["Hello doctor"]
+        assert segments == [(0, "Hello doctor")]
+
+    def test_native_batch_trims_silence_like_single_path(self, monkeypatch):
+        """Test batched chunks get the same VAD trim as vad_filter, and all-silent ones skip decoding"""
+        np = pytest.importorskip("numpy")
+        clips = {b"speech": np.ones(16000, dtype=np.float32), b"silence": np.zeros(16000, dtype=np.float32)}
+        decoded = []
+
+        def speech_timestamps(audio, options):
+            return [{"start": 4000, "end": 12000}] if audio.any() else []
+
+        def pcm_batch(model, audios):
+            decoded.extend(audios)
+            return ["Hello" for _ in audios]
+
+        model = type("NativeModel", (), {"feature_extractor": None, "hf_tokenizer": None, "encode": None, "model": None})()
+        monkeypatch.setattr(transcription, "acquire_model", lambda: nullcontext(model))
+        monkeypatch.setattr(transcription, "decode_audio_chunk", lambda chunk: clips[chunk])
+        monkeypatch.setattr(transcription, "get_speech_timestamps", speech_timestamps, raising=False)
+        monkeypatch.setattr(transcription, "VadOptions", lambda **kwargs: kwargs, raising=False)
+        monkeypatch.setattr(transcription, "_transcribe_pcm_batch", pcm_batch)
+
+        assert transcribe_batch([b"speech", b"silence"]) == ["Hello", ""]
+        assert [len(audio) for audio in decoded] == [8000]
+
+    def test_transcribe_batch_falls_back_without_native_batching(self, monkeypatch):
+        """Test models without batched encode are decoded chunk by chunk"""
+        model = FakeWhisperModel()
+        monkeypatch.setattr(transcription, "acquire_model", lambda: nullcontext(model))
+        assert transcribe_batch([b"a", b"b"]) == ["Hello doctor", "Hello doctor"]
+        assert len(model.sources) == 2
+
+
+class TestQualityTiers:
+    """Test the load-adaptive quality controller"""
+
+    def test_steps_down_under_load_and_back_up(self):
+        """Test deep queues degrade the tier and an idle queue restores it"""
+        controller = QualityController(dwell=0)
+        controller.observe_load(7, 8)
+        assert controller.tier["name"] == "reduced"
+        controller.observe_load(8, 8)
+        assert controller.tier["name"] == "light"
+        controller.observe_load(8, 8)
+        assert controller.level == 2
+
+        controller.observe_load(0, 8)
+        controller.observe_load(0, 8)
+        assert controller.tier["name"] == "full"
+        stats = controller.stats()
+        assert stats["changes"] == 4
+        assert [c["to"] for c in stats["recent_changes"]] == ["reduced", "light", "reduced", "full"]
+
+    def test_slow_decoding_degrades_and_dwell_prevents_flapping(self):
+        """Test a high real-time factor switches tier, but only once per dwell period"""
+        controller = QualityController(dwell=60, light_model=False)
+        for _ in range(5):
+            controller.observe_decode(audio_seconds=3.0, elapsed=6.0)
+        assert controller.tier["name"] == "reduced"
+        assert controller.changes == 1
+
+    def test_disabled_controller_stays_at_full_quality(self):
+        """Test TRANSCRIBE_ADAPTIVE=false pins the full tier"""
+        controller = QualityController(enabled=False, dwell=0)
+        controller.observe_load(8, 8)
+        assert controller.tier["name"] == "full"
+
+    async def test_degraded_batches_are_decoded_with_the_tier(self):
+        """Test the scheduler tells the batch function which tier to use"""
+        tiers = []
+
+        def batch_fn(chunks, tier=None):
+            tiers.append(tier)
+            return ["" for _ in chunks]
+
+        controller = QualityController(dwell=0)
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        scheduler = TranscriptionScheduler(executor, batch_fn=batch_fn, max_wait_ms=0, max_pending=1, quality=controller)
+        await scheduler.submit(1, b"a")
+        assert tiers == ["reduced"]
+        scheduler.shutdown()
+        executor.shutdown()
+
+    def test_degraded_tier_tightens_the_vad_gate(self):
+        """Test quiet speech passes at full quality but not in a degraded tier"""
+        np = pytest.importorskip("numpy")
+        gate = VoiceActivityGate(mode="energy", threshold_db=-45, min_speech_ms=200)
+        quiet = np.full(16000, 10 ** (-42 / 20), dtype=np.float32)
+        assert gate.has_speech(quiet)
+        assert not gate.has_speech(quiet, threshold_offset_db=6.0)
+
+
+@pytest.fixture(name="socket_path")
+def socket_path_fixture():
+    # Unix socket paths are length-limited, so keep it short
+    directory = tempfile.mkdtemp(prefix="cv")
+    yield os.path.join(directory, "t.sock")
+    for name in os.listdir(directory):
+        os.unlink(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+class TestTranscriptionService:
+    """Test the shared transcription service and its client"""
+
+    def test_frames_round_trip(self):
+        """Test encoded chunks survive the wire format"""
+        assert decode_chunks(encode_chunks([b"webm-bytes", b""])) == [b"webm-bytes", b""]
+
+    def test_pcm_frames_round_trip(self):
+        """Test decoded PCM is shipped as float32"""
+        np = pytest.importorskip("numpy")
+        pcm = np.linspace(-1, 1, 160, dtype=np.float32)
+        (decoded,) = decode_chunks(encode_chunks([pcm]))
+        assert np.array_equal(decoded, pcm)
+
+    async def test_client_reuses_connection(self, socket_path):
+        """Test several batches go over one pooled connection"""
+        connections = []
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        service = TranscriptionService(
+            socket_path, executor=executor, batch_fn=lambda chunks: [c.decode().upper() for c in chunks]
+        )
+        handle = service._handle
+
+        async def counting_handle(reader, writer):
+            connections.append(writer)
+            await handle(reader, writer)
+
+        service._handle = counting_handle
+        await service.start()
+        client = TranscriptionServiceClient(socket_path, timeout=5)
+        assert await client.transcribe([b"a", b"b"]) == ["A", "B"]
+        assert await client.transcribe([b"c"]) == ["C"]
+        assert len(connections) == 1
+        client.close()
+        await service.close()
+        executor.shutdown()
+
+    async def test_service_busy_reaches_the_client(self, socket_path):
+        """Test the service's backpressure surfaces as TranscriptionBusy"""
+        executor = TranscriptionExecutor(max_workers=1, max_queue=0, timeout=5, retry_after=7)
+        gate = threading.Event()
+        service = TranscriptionService(socket_path, executor=executor, batch_fn=lambda chunks: gate.wait(5) and [""])
+        await service.start()
+        first_client = TranscriptionServiceClient(socket_path, timeout=5)
+        second_client = TranscriptionServiceClient(socket_path, timeout=5)
+        first = asyncio.ensure_future(first_client.transcribe([b"a"]))
+        await asyncio.sleep(0.05)
+        with pytest.raises(TranscriptionBusy) as exc:
+            await second_client.transcribe([b"b"])
+        assert exc.value.retry_after == 7
+        gate.set()
+        assert await first == [""]
+        first_client.close()
+        second_client.close()
+        await service.close()
+        executor.shutdown()
+
+    async def test_unreachable_service_is_reported(self, socket_path):
+        """Test a missing socket raises TranscriptionServiceUnavailable"""
+        client = TranscriptionServiceClient(socket_path, timeout=1)
+        with pytest.raises(TranscriptionServiceUnavailable):
+            await client.transcribe([b"a"])
+
+    async def test_scheduler_falls_back_in_process(self, socket_path):
+        """Test the scheduler decodes locally when the service is down"""
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        scheduler = TranscriptionScheduler(
+            executor, batch_fn=lambda chunks: ["local" for _ in chunks], max_wait_ms=0,
+            service=TranscriptionServiceClient(socket_path, timeout=1)
+        )
+        assert await scheduler.submit(1, b"a") == "local"
+        scheduler.shutdown()
+        executor.shutdown()
+
+    async def test_service_error_falls_back_in_process(self, socket_path):
+        """Test an error inside the service is decoded locally instead of failing the chunk"""
+        def broken(chunks):
+            raise ValueError("model crashed")
+
+        service_executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        service = TranscriptionService(socket_path, executor=service_executor, batch_fn=broken)
+        await service.start()
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        client = TranscriptionServiceClient(socket_path, timeout=5)
+        scheduler = TranscriptionScheduler(
+            executor, batch_fn=lambda chunks: ["local" for _ in chunks], max_wait_ms=0, service=client
+        )
+        assert await scheduler.submit(1, b"a") == "local"
+        scheduler.shutdown()
+        client.close()
+        await service.close()
+        executor.shutdown()
+        service_executor.shutdown()
+
+    async def test_quality_tier_reaches_the_service(self, socket_path):
+        """Test a degraded tier picked by the worker is applied by the service"""
+        tiers = []
+
+        def batch_fn(chunks, tier=None):
+            tiers.append(tier)
+            return ["remote" for _ in chunks]
+
+        service_executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        service = TranscriptionService(socket_path, executor=service_executor, batch_fn=batch_fn)
+        await service.start()
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        client = TranscriptionServiceClient(socket_path, timeout=5)
+        scheduler = TranscriptionScheduler(
+            executor, batch_fn=lambda chunks: ["local" for _ in chunks], max_wait_ms=0, max_pending=1,
+            service=client, quality=QualityController(dwell=0)
+        )
+        assert await scheduler.submit(1, b"a") == "remote"
+        assert await client.transcribe([b"b"]) == ["remote"]
+        assert tiers == ["reduced", None]
+        scheduler.shutdown()
+        client.close()
+        await service.close()
+        executor.shutdown()
+        service_executor.shutdown()
+
+    async def test_scheduler_uses_service(self, socket_path):
+        """Test batches go to the service when it is up"""
+        service_executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        service = TranscriptionService(
+            socket_path, executor=service_executor, batch_fn=lambda chunks: ["remote" for _ in chunks]
+        )
+        await service.start()
+        executor = TranscriptionExecutor(max_workers=1, max_queue=2, timeout=5)
+        client = TranscriptionServiceClient(socket_path, timeout=5)
+        scheduler = TranscriptionScheduler(
+            executor, batch_fn=lambda chunks: ["local" for _ in chunks], max_wait_ms=0, service=client
+        )
+        assert await scheduler.submit(1, b"a") == "remote"
+        scheduler.shutdown()
+        client.close()
+        await service.close()
+        executor.shutdown()
+        service_executor.shutdown()
+
+
+@pytest.fixture(name="consultation")
+def consultation_fixture(session: Session):
+    patient = User(email="p@example.com", hashed_password="x", full_name="Pat", role=UserRole.PATIENT)
+    doctor = User(email="d@example.com", hashed_password="x", full_name="Dr. Doc", role=UserRole.DOCTOR)
+    session.add(patient)
+    session.add(doctor)
+    session.commit()
+    consult = Consultation(
+        patient_id=patient.id,
+        doctor_id=doctor.id,
+        specialty="General",
+        status=ConsultationStatus.ACTIVE,
+        symptoms_enc=encrypt_phi("Cough")
+    )
+    session.add(consult)
+    session.commit()
+    session.refresh(consult)
+    return consult
+
+
+class TestTranscriptStore:
+    """Test append-only encrypted transcript segments"""
+
+    def test_segments_are_sequenced_and_encrypted(self, session: Session, consultation: Consultation):
+        """Test each chunk becomes its own encrypted row with the next sequence"""
+        append_transcript_segment(session, consultation.id, consultation.patient_id, "I have a cough")
+        append_transcript_segment(session, consultation.id, consultation.doctor_id, "Since when?")
+
+        from sqlmodel import select
+        segments = session.exec(
+            select(TranscriptSegment).order_by(TranscriptSegment.sequence)
+        ).all()
+        assert [s.sequence for s in segments] == [1, 2]
+        assert "cough" not in segments[0].text_enc
+        assert decrypt_phi(segments[1].text_enc) == "Since when?"
+
+    def test_segments_record_offsets_within_the_consultation(self, session: Session, consultation: Consultation):
+        """Test start/end offsets are measured from the consultation start"""
+        from datetime import datetime, timedelta
+        consultation.started_at = datetime(2024, 1, 1, 10, 0, 0)
+        session.add(consultation)
+        session.commit()
+
+        segment = append_transcript_segment(
+            session, consultation.id, consultation.patient_id, "I have a cough",
+            spoken_until=consultation.started_at + timedelta(seconds=65), duration=3.0
+        )
+        assert (segment.start_ms, segment.end_ms) == (62000, 65000)
+
+        without_duration = append_transcript_segment(
+            session, consultation.id, consultation.patient_id, "Since when?",
+            spoken_until=consultation.started_at + timedelta(seconds=70)
+        )
+        assert (without_duration.start_ms, without_duration.end_ms) == (None, 70000)
+
+    def test_empty_text_is_not_stored(self, session: Session, consultation: Consultation):
+        """Test silent chunks do not create rows"""
+        assert append_transcript_segment(session, consultation.id, consultation.patient_id, "") is None
+
+    def test_lazy_transcript_assembles_with_speakers(self, session: Session, consultation: Consultation):
+        """Test the assembler labels speakers and keeps legacy text first"""
+        append_transcript_segment(session, consultation.id, consultation.patient_id, "I have a cough")
+        transcript = LazyTranscript(
+            session, consultation.id, legacy_enc=encrypt_phi("Earlier notes"),
+            speakers={consultation.patient_id: "Pat"}
+        )
+        assert str(transcript) == "Earlier notes\nPat: I have a cough"
+
+    def test_lazy_transcript_preview_and_truthiness(self, session: Session, consultation: Consultation):
+        """Test preview truncation and empty transcripts"""
+        assert not LazyTranscript(session, consultation.id)
+
+        for i in range(5):
+            append_transcript_segment(session, consultation.id, consultation.patient_id, f"sentence number {i}")
+        transcript = LazyTranscript(session, consultation.id)
+        assert transcript
+        text, truncated = transcript.preview(20)
+        assert text == "sentence number 0\nse"
+        assert truncated
+
+
+class TestChunkCache:
+    """Test the retransmitted-chunk cache"""
+
+    def test_hit_and_miss_counters(self):
+        """Test repeated chunks hit and new chunks miss"""
+        cache = ChunkCache(max_entries=4, ttl=60)
+        key = cache.key(b"chunk", 1, 1, ("base",))
+        assert cache.get(key) is None
+        cache.put(key, "Hello")
+        assert cache.get(key) == "Hello"
+        assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "in_flight": 0, "joined": 0}
+
+    def test_key_depends_on_room_and_decode_params(self):
+        """Test identical bytes from another room or model do not collide"""
+        base = ChunkCache.key(b"chunk", 1, 1, ("base",))
+        assert ChunkCache.key(b"chunk", 2, 1, ("base",)) != base
+        assert ChunkCache.key(b"chunk", 1, 1, ("tiny",)) != base
+
+    def test_lru_eviction(self):
+        """Test the oldest unused entry is evicted first"""
+        cache = ChunkCache(max_entries=2, ttl=60)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        cache.get("a")
+        cache.put("c", "C")
+        assert cache.get("b") is None
+        assert cache.get("a") == "A"
+
+    def test_ttl_expiry(self):
+        """Test entries expire after their TTL"""
+        cache = ChunkCache(max_entries=2, ttl=0)
+        cache.put("a", "A")
+        time.sleep(0.01)
+        assert cache.get("a") is None
+
+
+class TestVoiceActivityGate:
+    """Test the pre-queue voice-activity gate"""
+
+    @pytest.fixture(autouse=True)
+    def numpy(self):
+        return pytest.importorskip("numpy")
+
+    def test_silence_is_rejected(self, numpy):
+        """Test silent and near-silent PCM is gated out"""
+        gate = VoiceActivityGate(mode="energy")
+        assert not gate.has_speech(numpy.zeros(48000, dtype=numpy.float32))
+        hiss = numpy.random.default_rng(0).normal(0, 0.001, 48000).astype(numpy.float32)
+        assert not gate.has_speech(hiss)
+
+    def test_voiced_audio_passes(self, numpy):
+        """Test loud enough audio for long enough passes the gate"""
+        gate = VoiceActivityGate(mode="energy", min_speech_ms=200)
+        pcm = numpy.zeros(48000, dtype=numpy.float32)
+        t = numpy.arange(8000) / 16000
+        pcm[16000:24000] = 0.2 * numpy.sin(2 * numpy.pi * 200 * t)
+        assert gate.has_speech(pcm)
+
+    def test_short_click_is_rejected(self, numpy):
+        """Test a single loud frame is not mistaken for speech"""
+        gate = VoiceActivityGate(mode="energy", min_speech_ms=200)
+        pcm = numpy.zeros(48000, dtype=numpy.float32)
+        pcm[1000:1480] = 0.5
+        assert not gate.has_speech(pcm)
+
+    def test_counts_saved_decodes_per_consultation(self):
+        """Test skipped chunks are counted per consultation"""
+        gate = VoiceActivityGate(mode="energy")
+        gate.record(1, skipped=True)
+        gate.record(1, skipped=False)
+        gate.record(2, skipped=True)
+        stats = gate.stats()
+        assert stats["decodes_saved"] == 2
+        assert stats["consultations"]["1"] == {"checked": 2, "skipped": 1}
+
+
+class TestTranscribeEndpoint:
+    """Test POST /consultation/transcribe"""
+
+    def test_transcribe_returns_ok(self, client: TestClient, consultation: Consultation):
+        """Test that a chunk is accepted and processed"""
+        response = client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+            files={"audio_blob": ("chunk.webm", b"\x1a\x45\xdf\xa3" * 512, "audio/webm")}
+        )
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok"
+
+    def test_transcribe_rejects_non_participants(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test chunks for an unknown, finished or foreign consultation are refused before decoding"""
+        async def submit(consultation_id, audio, on_partial=None):
+            raise AssertionError("chunk was decoded")
+
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", submit)
+
+        def post(consultation_id, user_id):
+            return client.post(
+                "/consultation/transcribe",
+                data={"consultation_id": consultation_id, "user_id": user_id},
+                files={"audio_blob": ("chunk.webm", b"\x1a\x45\xdf\xa3" * 512, "audio/webm")}
+            )
+
+        assert post(consultation.id + 1, consultation.patient_id).status_code == 403
+        assert post(consultation.id, 999).status_code == 403
+        consultation.status = ConsultationStatus.COMPLETED
+        session.add(consultation)
+        session.commit()
+        assert post(consultation.id, consultation.doctor_id).status_code == 403
+
+        from sqlmodel import select
+        assert session.exec(select(TranscriptSegment)).all() == []
+
+    def test_transcribe_busy_returns_429(self, client: TestClient, consultation: Consultation, monkeypatch):
+        """Test backpressure when the transcription pool is saturated"""
+        async def busy(*args):
+            raise TranscriptionBusy(retry_after=7)
+
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", busy)
+        response = client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+            files={"audio_blob": ("chunk.webm", b"\x1a\x45\xdf\xa3" * 512, "audio/webm")}
+        )
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "7"
+
+    def test_saturated_pipeline_refuses_before_decoding(self, client: TestClient, consultation: Consultation, monkeypatch):
+        """Test a chunk the queue cannot take is refused without a container decode"""
+        def prepare(audio):
+            raise AssertionError("chunk was decoded")
+
+        scheduler = TranscriptionScheduler(TranscriptionExecutor(max_workers=1), max_pending=1)
+        scheduler.preparing = 1  # Another request's chunk is being gated
+        monkeypatch.setattr(workflow, "transcription_scheduler", scheduler)
+        monkeypatch.setattr(workflow, "prepare_chunk", prepare)
+        response = client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+            files={"audio_blob": ("chunk.webm", b"\x1a\x45\xdf\xa3" * 512, "audio/webm")}
+        )
+        assert response.status_code == 429
+        assert scheduler.preparing == 1
+        scheduler.executor.shutdown()
+
+    def test_dropped_chunk_is_not_retried(self, client: TestClient, consultation: Consultation, monkeypatch):
+        """Test a chunk dropped from a room's backlog answers 200 instead of 429"""
+        async def dropped(*args):
+            raise TranscriptionDropped(retry_after=7)
+
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", dropped)
+        response = client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+            files={"audio_blob": ("chunk.webm", b"\x1a\x45\xdf\xa3" * 512, "audio/webm")}
+        )
+        assert response.status_code == 200
+        assert response.json()["dropped"] is True
+        assert "retry-after" not in response.headers
+
+    def test_transcribe_persists_segment(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test transcribed text is appended to the segment store"""
+        async def submit(consultation_id, audio, on_partial=None):
+            return "My chest hurts"
+
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", submit)
+        response = client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+            files={"audio_blob": ("chunk.webm", b"\x1a\x45\xdf\xa3" * 512, "audio/webm")}
+        )
+        assert response.status_code == 200
+
+        from sqlmodel import select
+        segment = session.exec(select(TranscriptSegment)).one()
+        assert segment.speaker_id == consultation.patient_id
+        assert decrypt_phi(segment.text_enc) == "My chest hurts"
+
+    async def test_retry_during_decode_shares_the_first_decode(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test a retry that arrives mid-decode waits for it instead of decoding again"""
+        import httpx
+        decodes, broadcasts = [], []
+        release = asyncio.Event()
+
+        async def submit(consultation_id, audio, on_partial=None):
+            decodes.append(audio)
+            await release.wait()
+            return "My chest hurts"
+
+        async def broadcast(message, room_id):
+            broadcasts.append(message)
+
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", submit)
+        monkeypatch.setattr(workflow.manager, "broadcast", broadcast)
+
+        async def post(http):
+            return await http.post(
+                "/consultation/transcribe",
+                data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+                files={"audio_blob": ("chunk.webm", b"retry-bytes" * 100, "audio/webm")}
+            )
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            first = asyncio.ensure_future(post(http))
+            await asyncio.sleep(0.05)
+            retry = asyncio.ensure_future(post(http))
+            await asyncio.sleep(0.05)
+            release.set()
+            responses = await asyncio.gather(first, retry)
+
+        assert [r.json()["text"] for r in responses] == ["My chest hurts", "My chest hurts"]
+        assert responses[1].json()["duplicate"] is True
+        assert len(decodes) == 1
+        assert len(broadcasts) == 1
+
+    def test_retransmitted_chunk_is_not_decoded_twice(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test a re-POSTed chunk returns the cached text without a second broadcast"""
+        decodes, broadcasts = [], []
+
+        async def submit(consultation_id, audio, on_partial=None):
+            decodes.append(audio)
+            return "My chest hurts"
+
+        async def broadcast(message, room_id):
+            broadcasts.append(message)
+
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", submit)
+        monkeypatch.setattr(workflow.manager, "broadcast", broadcast)
+        for _ in range(2):
+            response = client.post(
+                "/consultation/transcribe",
+                data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+                files={"audio_blob": ("chunk.webm", b"same-bytes" * 100, "audio/webm")}
+            )
+            assert response.json()["text"] == "My chest hurts"
+        assert response.json()["duplicate"] is True
+        assert len(decodes) == 1
+        assert len(broadcasts) == 1
+
+        from sqlmodel import select
+        assert len(session.exec(select(TranscriptSegment)).all()) == 1
+
+    def test_silent_chunk_never_reaches_the_queue(self, client: TestClient, consultation: Consultation, monkeypatch):
+        """Test chunks rejected by the VAD gate are not transcribed"""
+        async def submit(consultation_id, audio, on_partial=None):
+            raise AssertionError("silent chunk was queued")
+
+        monkeypatch.setattr(workflow, "prepare_chunk", lambda audio: (audio, False))
+        monkeypatch.setattr(workflow, "voice_gate", VoiceActivityGate())
+        monkeypatch.setattr(workflow.transcription_scheduler, "submit", submit)
+        response = client.post(
+            "/consultation/transcribe",
+            data={"consultation_id": consultation.id, "user_id": consultation.patient_id},
+            files={"audio_blob": ("chunk.webm", b"silence" * 100, "audio/webm")}
+        )
+        assert response.json()["skipped"] is True
+        assert workflow.voice_gate.stats()["consultations"][str(consultation.id)]["skipped"] == 1
+
+    def test_stats_requires_admin(self, client: TestClient, session: Session):
+        """Test transcription stats are admin only"""
+        admin = User(email="admin@example.com", hashed_password="x", full_name="Admin", role=UserRole.ADMIN)
+        patient = User(email="pat@example.com", hashed_password="x", full_name="Pat", role=UserRole.PATIENT)
+        session.add(admin)
+        session.add(patient)
+        session.commit()
+
+        client.cookies.set("access_token", f"Bearer {create_access_token(data={'sub': patient.email})}")
+        assert client.get("/admin/transcription/stats").status_code == 403
+
+        client.cookies.set("access_token", f"Bearer {create_access_token(data={'sub': admin.email})}")
+        response = client.get("/admin/transcription/stats")
+        assert response.status_code == 200
+        assert "hits" in response.json()["cache"]
+
+    def test_admin_sets_room_weight(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test the weight endpoint configures the scheduler"""
+        scheduler = TranscriptionScheduler(TranscriptionExecutor(max_workers=1))
+        monkeypatch.setattr(admin_router, "transcription_scheduler", scheduler)
+        admin = User(email="admin@example.com", hashed_password="x", full_name="Admin", role=UserRole.ADMIN)
+        session.add(admin)
+        session.commit()
+        client.cookies.set("access_token", f"Bearer {create_access_token(data={'sub': admin.email})}")
+
+        response = client.post("/admin/transcription/weight", data={"consultation_id": consultation.id, "weight": 3})
+        assert response.status_code == 200
+        assert scheduler._weights == {consultation.id: 3}
+        assert client.post(
+            "/admin/transcription/weight", data={"consultation_id": consultation.id, "weight": 99}
+        ).status_code == 400
+        client.post("/admin/transcription/weight", data={"consultation_id": consultation.id, "weight": 1})
+        assert scheduler._weights == {}
+        scheduler.executor.shutdown()
+
+
+class TestAudioStream:
+    """Test server-side windowing of streamed audio"""
+
+    def test_pcm_stream_is_cut_on_exact_windows(self):
+        """Test PCM frames are windowed by sample count regardless of frame size"""
+        stream = AudioStream(fmt="pcm16", window_seconds=0.5)
+        windows = []
+        for _ in range(10):
+            windows += stream.feed(b"\x00\x01" * 1600)  # 0.1s per frame
+        assert len(windows) == 2
+        assert all(len(w) == 8000 for w in windows)
+        assert stream.flush() is None
+
+    def test_webm_windows_carry_the_container_header(self):
+        """Test every webm window is decodable on its own"""
+        stream = AudioStream(fmt="webm", window_seconds=0)
+        assert stream.feed(b"HEADER") == []
+        assert stream.feed(b"cluster1") == [b"HEADERcluster1"]
+        assert stream.feed(b"cluster2") == [b"HEADERcluster2"]
+
+    def test_first_webm_cluster_is_audio_not_header(self):
+        """Test the first blob's audio is transcribed once, not prepended to every window"""
+        cluster = b"\x1f\x43\xb6\x75"
+        stream = AudioStream(fmt="webm", window_seconds=0)
+        assert stream.feed(b"EBML" + cluster + b"first-second") == [b"EBML" + cluster + b"first-second"]
+        assert stream.feed(cluster + b"second") == [b"EBML" + cluster + b"second"]
+
+    def test_flush_returns_partial_window(self):
+        """Test stopping the stream transcribes the tail"""
+        stream = AudioStream(fmt="webm", window_seconds=60)
+        stream.feed(b"HEADER")
+        stream.feed(b"tail")
+        assert stream.flush() == b"HEADERtail"
+
+    def test_buffer_is_capped_when_transcriber_falls_behind(self):
+        """Test a stream never buffers more than a few windows"""
+        stream = AudioStream(fmt="webm", window_seconds=60, max_buffered_windows=1)
+        stream.feed(b"H")
+        stream.feed(b"x" * (AudioStream.BYTES_PER_SECOND * 120))
+        assert len(stream.flush()) <= 1 + AudioStream.BYTES_PER_SECOND * 60
+
+
+class TestStreamDecoder:
+    """Test persistent per-stream decoding"""
+
+    @staticmethod
+    def _element(element_id: bytes, payload: bytes) -> bytes:
+        assert len(payload) < 127
+        return element_id + bytes([0x80 | len(payload)]) + payload
+
+    def _webm(self, packets):
+        unknown = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+        tracks = self._element(b"\x16\x54\xae\x6b", self._element(b"\xae", self._element(b"\x86", b"A_OPUS")))
+        blocks = b"".join(self._element(b"\xa3", b"\x81\x00\x00\x80" + p) for p in packets)
+        return (self._element(b"\x1a\x45\xdf\xa3", b"\x42\x86\x81\x01")
+                + b"\x18\x53\x80\x67" + unknown + tracks
+                + b"\x1f\x43\xb6\x75" + unknown + self._element(b"\xe7", b"\x00") + blocks)
+
+    def test_demuxer_handles_elements_split_across_feeds(self):
+        """Test packets come out once, whole, however the bytes are split"""
+        data = self._webm([b"opus-1", b"opus-2", b"opus-3"])
+        demuxer = WebmDemuxer()
+        packets = []
+        for i in range(0, len(data), 3):
+            packets += demuxer.feed(data[i:i + 3])
+        assert packets == [b"opus-1", b"opus-2", b"opus-3"]
+        assert demuxer.codec_id == "A_OPUS"
+
+    def test_ring_buffer_wraps_and_overwrites_oldest(self):
+        """Test a full ring keeps the newest samples and counts the loss"""
+        ring = PcmRingBuffer(4)
+        ring.write([1, 2, 3])
+        assert list(ring.read(2)) == [1, 2]
+        ring.write([4, 5, 6, 7])
+        assert ring.overwritten == 1
+        assert list(ring.read(10)) == [4, 5, 6, 7]
+        ring.write(range(10))
+        assert list(ring.read(10)) == [6, 7, 8, 9]
+
+    def test_pcm_odd_byte_is_carried_to_the_next_feed(self):
+        """Test a sample split across frames is reassembled"""
+        decoder = StreamDecoder("pcm16", 16)
+        decoder.feed(b"\x00\x40\x00")
+        decoder.feed(b"\xc0")
+        assert list(decoder.ring.read(2)) == [0.5, -0.5]
+
+    def test_uplinks_are_torn_down_with_the_consultation(self, monkeypatch):
+        """Test ending a consultation releases its participants' decoders"""
+        monkeypatch.setattr(workflow, "audio_uplinks", {})
+        first = workflow.open_audio_uplink(5, 1)
+        replaced = workflow.open_audio_uplink(5, 2)
+        other = workflow.open_audio_uplink(6, 1)
+        for uplink in (first, replaced, other):
+            uplink.start("pcm16")
+            assert uplink.stream.decoder is not None
+        second = workflow.open_audio_uplink(5, 2)
+        second.start("pcm16")
+        assert replaced.stream.decoder is None
+        workflow.close_audio_uplinks(5)
+        assert first.stream.decoder is None and second.stream.decoder is None
+        assert list(workflow.audio_uplinks) == [(6, 1)]
+        other.close()
+        assert workflow.audio_uplinks == {}
+
+    async def test_audio_after_teardown_is_not_transcribed(self, monkeypatch):
+        """Test a socket still feeding after the consultation ended decodes nothing"""
+        windows = []
+
+        async def transcribe(consultation_id, audio, on_partial=None):
+            windows.append(audio)
+
+        monkeypatch.setattr(workflow, "_transcribe_audio", transcribe)
+        monkeypatch.setattr(workflow, "audio_uplinks", {})
+        monkeypatch.setattr(settings, "TRANSCRIBE_STREAM_WINDOW_S", 1)
+        uplink = workflow.open_audio_uplink(1, 1)
+        uplink.start("pcm16")
+        workflow.close_audio_uplinks(1)
+
+        uplink.feed(b"\x00\x10" * 16000 * 4)
+        uplink.start("pcm16")
+        uplink.feed(b"\x00\x10" * 16000 * 4)
+        uplink.stop()
+        await asyncio.sleep(0)
+        assert windows == []
+        assert uplink.worker is None
+
+
+class TestWebSocketAudio:
+    """Test streaming audio over the consultation WebSocket"""
+
+    def test_streamed_audio_comes_back_as_transcript(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test binary frames are windowed, transcribed and pushed on the same socket"""
+        windows = []
+
+        async def transcribe(consultation_id, audio, on_partial=None):
+            windows.append(audio)
+            return "Streaming works"
+
+        monkeypatch.setattr(workflow, "_transcribe_audio", transcribe)
+        monkeypatch.setattr(workflow, "engine", session.get_bind())
+        monkeypatch.setattr(settings, "TRANSCRIBE_STREAM_WINDOW_S", 0.1)
+
+        with client.websocket_connect(f"/ws/{consultation.id}/{consultation.patient_id}") as ws:
+            ws.send_json({"type": "audio_start", "format": "pcm16"})
+            ws.send_bytes(b"\x00\x00" * 1600)
+            message = ws.receive_json()
+        assert message["window"] == 1 and message["stream"]
+        assert {k: message[k] for k in ("type", "user_id", "text")} == {"type": "transcript", "user_id": consultation.patient_id, "text": "Streaming works"}
+        assert len(windows) == 1
+
+        from sqlmodel import select
+        segment = session.exec(select(TranscriptSegment)).one()
+        assert segment.consultation_id == consultation.id
+
+
+    def test_partial_captions_precede_the_final_transcript(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test running text is pushed as transcript_partial before the final line"""
+        async def transcribe(consultation_id, audio, on_partial=None):
+            on_partial("Hello")
+            await asyncio.sleep(0.01)
+            return "Hello doctor"
+
+        monkeypatch.setattr(workflow, "_transcribe_audio", transcribe)
+        monkeypatch.setattr(workflow, "engine", session.get_bind())
+        monkeypatch.setattr(settings, "TRANSCRIBE_STREAM_WINDOW_S", 0.1)
+
+        with client.websocket_connect(f"/ws/{consultation.id}/{consultation.patient_id}") as ws:
+            ws.send_json({"type": "audio_start", "format": "pcm16"})
+            ws.send_bytes(b"\x00\x00" * 1600)
+            partial = ws.receive_json()
+            final = ws.receive_json()
+        assert partial["type"] == "transcript_partial" and partial["text"] == "Hello" and partial["window"] == 1
+        assert final["type"] == "transcript" and final["text"] == "Hello doctor"
+        assert (final["stream"], final["window"]) == (partial["stream"], 1)
+
+    def test_failed_window_after_partials_is_closed(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test a window that fails after sending partials still gets an (empty) final frame"""
+        async def transcribe(consultation_id, audio, on_partial=None):
+            on_partial("Hel")
+            await asyncio.sleep(0.01)
+            raise TranscriptionTimeout("too slow")
+
+        monkeypatch.setattr(workflow, "_transcribe_audio", transcribe)
+        monkeypatch.setattr(workflow, "engine", session.get_bind())
+        monkeypatch.setattr(settings, "TRANSCRIBE_STREAM_WINDOW_S", 0.1)
+
+        with client.websocket_connect(f"/ws/{consultation.id}/{consultation.patient_id}") as ws:
+            ws.send_json({"type": "audio_start", "format": "pcm16"})
+            ws.send_bytes(b"\x00\x00" * 1600)
+            partial = ws.receive_json()
+            final = ws.receive_json()
+        assert partial["type"] == "transcript_partial"
+        assert final["type"] == "transcript" and final["text"] == ""
+        assert (final["stream"], final["window"]) == (partial["stream"], partial["window"])
+
+        from sqlmodel import select
+        assert session.exec(select(TranscriptSegment)).all() == []
+
+    def test_failed_window_does_not_stop_the_uplink(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test an unexpected error on one window leaves later windows flowing"""
+        calls = []
+
+        async def transcribe(consultation_id, audio, on_partial=None):
+            calls.append(audio)
+            if len(calls) == 1:
+                raise RuntimeError("decoder exploded")
+            return "Still here"
+
+        monkeypatch.setattr(workflow, "_transcribe_audio", transcribe)
+        monkeypatch.setattr(workflow, "engine", session.get_bind())
+        monkeypatch.setattr(settings, "TRANSCRIBE_STREAM_WINDOW_S", 0.1)
+
+        with client.websocket_connect(f"/ws/{consultation.id}/{consultation.patient_id}") as ws:
+            ws.send_json({"type": "audio_start", "format": "pcm16"})
+            ws.send_bytes(b"\x00\x00" * 3200)
+            message = ws.receive_json()
+        assert message["text"] == "Still here" and message["window"] == 2
+
+    def test_outsider_text_is_not_recorded(self, client: TestClient, session: Session, consultation: Consultation, monkeypatch):
+        """Test a socket for someone outside the consultation cannot add to its transcript"""
+        async def transcribe(consultation_id, audio, on_partial=None):
+            return "Injected"
+
+        monkeypatch.setattr(workflow, "_transcribe_audio", transcribe)
+        monkeypatch.setattr(workflow, "engine", session.get_bind())
+        monkeypatch.setattr(settings, "TRANSCRIBE_STREAM_WINDOW_S", 0.1)
+
+        with client.websocket_connect(f"/ws/{consultation.id}/999") as ws:
+            ws.send_json({"type": "audio_start", "format": "pcm16"})
+            ws.send_bytes(b"\x00\x00" * 1600)
+            ws.send_text("ping")
+            assert ws.receive_json()["type"] == "chat"
+
+        from sqlmodel import select
+        assert session.exec(select(TranscriptSegment)).all() == []
+
+
+class TestBenchmarkHarness:
+    """Smoke test for the transcription benchmark harness"""
+
+    def test_stub_benchmark_reports_latency_percentiles(self):
+        """Test a tiny stub run completes and reports its metrics"""
+        from benchmarks.transcription_bench import run_benchmark
+        report = run_benchmark(rooms=3, chunks=2, chunk_seconds=0.25, stub_latency=0.001)
+        assert report["requests"] == 6
+        assert report["ok"] == 6
+        assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"]
+        assert report["chunks_per_sec"] > 0
+
+    def test_stub_benchmark_measures_the_vad_gate(self):
+        """Test silent synthetic chunks are skipped by the gate in stub mode"""
+        pytest.importorskip("numpy")
+        from benchmarks.transcription_bench import run_benchmark
+        report = run_benchmark(rooms=2, chunks=4, chunk_seconds=0.5, stub_latency=0.001, silence_ratio=1.0)
+        assert report["vad_skipped"] == 8
@@ -244,6 +244,36 @@ class TestConsultation:
         response = authenticated_patient_client.get(f"/consultation/{consultation.id}")
         assert response.status_code == 200
     
+    def test_consultation_room_shows_previous_transcript(
+        self, authenticated_doctor_client: TestClient, test_patient: User, test_doctor: User, session: Session
+    ):
+        """Test the doctor's history view assembles transcripts from segments"""
+        from app.security import encrypt_phi
+        from app.transcripts import append_transcript_segment
+        previous = Consultation(
+            patient_id=test_patient.id,
+            doctor_id=test_doctor.id,
+            specialty="General",
+            status=ConsultationStatus.COMPLETED,
+            symptoms_enc=encrypt_phi("Cough"),
+            notes_enc=encrypt_phi("Rest")
+        )
+        current = Consultation(
+            patient_id=test_patient.id,
+            doctor_id=test_doctor.id,
+            specialty="General",
+            status=ConsultationStatus.ACTIVE,
+            symptoms_enc=encrypt_phi("Headache")
+        )
+        session.add(previous)
+        session.add(current)
+        session.commit()
+        append_transcript_segment(session, previous.id, test_patient.id, "The cough started on Monday")
+        
+        response = authenticated_doctor_client.get(f"/consultation/{current.id}")
+        assert response.status_code == 200
+        assert "Test Patient: The cough started on Monday" in response.text
+    
     def test_consultation_room_unauthorized(
         self, authenticated_patient_client: TestClient, test_doctor: User, session: Session
     ):